@@ -0,0 +1,150 @@
+import re
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sinaspider import console
+
+
+def normalize_url(url: str, params: dict | None = None) -> str:
+    """
+    Merge params into url and sort the query, so the same request
+    always gets the same url.
+    """
+    parts = urlsplit(str(url))
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query += [(k, str(v)) for k, v in (params or {}).items()
+              if v is not None]
+    query = urlencode(sorted(query))
+    return urlunsplit(parts._replace(query=query, fragment=''))
+
+
+class ResponseCache:
+    """
+    On-disk cache of json responses, with ttl per endpoint family.
+
+    Only urls matched by TTLS are cached, everything else always
+    goes to network.
+    """
+    # (url pattern, seconds to keep), first matched wins
+    TTLS = [
+        (r'place\.weibo\.com/wandermap/pois', 30 * 24 * 3600),
+        (r'/comments/build_comments', 7 * 24 * 3600),
+        (r'containerid=230283\d+_-_INFO', 24 * 3600),
+        (r'containerid=231051_-_myfollow_followprofile_list', 24 * 3600),
+        (r'containerid=100505\d+', 6 * 3600),
+    ]
+    MAX_SIZE = 256 * 1024 * 1024  # bytes
+
+    def __init__(self, path: Path,
+                 ttls: list[tuple[str, int]] | None = None,
+                 max_size: int | None = None) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.ttls = [(re.compile(p), ttl) for p, ttl in (ttls or self.TTLS)]
+        self.max_size = max_size or self.MAX_SIZE
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS response ('
+            'url TEXT, account TEXT, body BLOB, size INTEGER, '
+            'stored_at REAL, expires_at REAL, '
+            'PRIMARY KEY (url, account))')
+        self._conn.commit()
+
+    def __str__(self) -> str:
+        return f'{self.hits} hits, {self.misses} misses ({self.path})'
+
+    def ttl(self, url: str) -> int | None:
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+
+    def get(self, url: str, account: str) -> bytes | None:
+        row = self._conn.execute(
+            'SELECT body FROM response '
+            'WHERE url = ? AND account = ? AND expires_at > ?',
+            (url, account, time.time())).fetchone()
+        if row is None:
+            self.misses += 1
+            return
+        self.hits += 1
+        return zlib.decompress(row[0])
+
+    def set(self, url: str, account: str, body: bytes):
+        if not (ttl := self.ttl(url)):
+            return
+        body = zlib.compress(body)
+        now = time.time()
+        self._conn.execute(
+            'INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?)',
+            (url, account, body, len(body), now, now + ttl))
+        self._conn.commit()
+        self._evict()
+
+    def invalidate(self, pattern: str) -> int:
+        """
+        drop cached responses whose url contains pattern
+        """
+        cursor = self._conn.execute(
+            "DELETE FROM response WHERE instr(url, ?) > 0", (pattern,))
+        self._conn.commit()
+        return cursor.rowcount
+
+    def _evict(self):
+        self._conn.execute(
+            'DELETE FROM response WHERE expires_at <= ?', (time.time(),))
+        size, = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM response').fetchone()
+        if size > self.max_size:
+            rows = self._conn.execute(
+                'SELECT url, account, size FROM response '
+                'ORDER BY stored_at').fetchall()
+            evicted = 0
+            for url, account, row_size in rows:
+                if size <= self.max_size * 0.9:
+                    break
+                self._conn.execute(
+                    'DELETE FROM response WHERE url = ? AND account = ?',
+                    (url, account))
+                size -= row_size
+                evicted += 1
+            console.log(f'{evicted} responses evicted from cache',
+                        style='info')
+        self._conn.commit()
+
+
+class DeadUrls:
+    """
+    Urls confirmed gone, so they are skipped without a request.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.skipped = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS dead_url ('
+            'url TEXT PRIMARY KEY, reason TEXT, added_at REAL)')
+        self._conn.commit()
+
+    def __str__(self) -> str:
+        count, = self._conn.execute(
+            'SELECT COUNT(*) FROM dead_url').fetchone()
+        return f'{count} dead urls, {self.skipped} skipped ({self.path})'
+
+    def __contains__(self, url: str) -> bool:
+        row = self._conn.execute(
+            'SELECT 1 FROM dead_url WHERE url = ?',
+            (normalize_url(url),)).fetchone()
+        return row is not None
+
+    def add(self, url: str, reason: str):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO dead_url VALUES (?, ?, ?)',
+            (normalize_url(url), reason, time.time()))
+        self._conn.commit()
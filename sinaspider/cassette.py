@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+from sinaspider.cache import normalize_url
+from sinaspider.exceptions import CassetteMiss
+
+
+class Cassette:
+    """
+    Recorded http interactions, stored compressed in a sqlite file.
+
+    In record mode every request goes to network and the response is
+    saved; in replay mode the saved responses are served back without
+    touching network. Identical requests are replayed in the order
+    they were recorded, the last one repeats once exhausted.
+    """
+
+    def __init__(self, path: Path, mode: str = 'replay',
+                 latency: float | None = None) -> None:
+        """
+        Args:
+            mode: 'record' or 'replay'
+            latency: seconds to wait before serving a replayed response,
+                None to wait as long as it took when recorded
+        """
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'unknown cassette mode: {mode}')
+        if mode == 'replay' and not path.exists():
+            raise FileNotFoundError(f'cassette {path} not exists')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.recorded = 0
+        self.replayed = 0
+        self._cursors: dict[str, int] = defaultdict(int)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS interaction ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, '
+            'status INTEGER, headers TEXT, body BLOB, elapsed REAL)')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS interaction_key '
+            'ON interaction (key)')
+        self._conn.commit()
+
+    def __str__(self) -> str:
+        return (f'{self.mode} {self.path}: {self.recorded} recorded, '
+                f'{self.replayed} replayed')
+
+    @staticmethod
+    def key(request: httpx.Request) -> str:
+        key = f'{request.method} {normalize_url(request.url)}'
+        if request.content:
+            key += ' ' + hashlib.sha1(request.content).hexdigest()
+        return key
+
+    def record(self, request: httpx.Request, response: httpx.Response,
+               body: bytes, elapsed: float):
+        """
+        save the response, body is the raw (undecoded) content
+        """
+        self._conn.execute(
+            'INSERT INTO interaction '
+            '(key, status, headers, body, elapsed) VALUES (?, ?, ?, ?, ?)',
+            (self.key(request), response.status_code,
+             json.dumps(response.headers.multi_items()),
+             zlib.compress(body), elapsed))
+        self._conn.commit()
+        self.recorded += 1
+
+    def play(self, request: httpx.Request) -> tuple[httpx.Response, float]:
+        """
+        return the saved response of request and its recorded elapsed
+        """
+        key = self.key(request)
+        rows = self._conn.execute(
+            'SELECT status, headers, body, elapsed FROM interaction '
+            'WHERE key = ? ORDER BY id', (key,)).fetchall()
+        if not rows:
+            raise CassetteMiss(f'{key} not found in {self.path}')
+        cursor = self._cursors[key]
+        self._cursors[key] += 1
+        status, headers, body, elapsed = rows[min(cursor, len(rows) - 1)]
+        self.replayed += 1
+        response = httpx.Response(
+            status, headers=json.loads(headers),
+            content=zlib.decompress(body), request=request)
+        return response, elapsed
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """
+    Transport records to or replays from cassette, wraps the real one.
+    """
+
+    def __init__(self, cassette: Cassette,
+                 transport: httpx.AsyncBaseTransport) -> None:
+        self.cassette = cassette
+        self.transport = transport
+
+    async def handle_async_request(
+            self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        if self.cassette.mode == 'replay':
+            response, elapsed = self.cassette.play(request)
+            latency = self.cassette.latency
+            await asyncio.sleep(elapsed if latency is None else latency)
+            return response
+        start = time.monotonic()
+        response = await self.transport.handle_async_request(request)
+        # keep the raw content, so content-encoding still matches
+        try:
+            body = b''.join([chunk async for chunk in response.stream])
+        finally:
+            await response.aclose()
+        self.cassette.record(request, response, body,
+                             time.monotonic() - start)
+        return httpx.Response(
+            response.status_code, headers=response.headers,
+            content=body, request=request, extensions=response.extensions)
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -20,3 +20,32 @@ class DownloadFilesFailed(Exception):
         super().__init__()
         self.imgs = imgs
         self.errs = errs
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class RequestFailed(Exception):
+    def __init__(self, err_msg, url):
+        super().__init__(f"{err_msg} for {url}")
+        self.err_msg = err_msg
+        self.url = url
+
+
+class RetryLater(Exception):
+    """
+    Download should be retried after delay, from the attempt.
+    """
+
+    def __init__(self, url: str, attempt: int, delay: float) -> None:
+        super().__init__(f'retry {url} in {delay} seconds')
+        self.url = url
+        self.attempt = attempt
+        self.delay = delay
+
+
+class MediaExpired(Exception):
+    def __init__(self, url: str, expires) -> None:
+        super().__init__(f'{url} expired at {expires}')
+        self.url = url
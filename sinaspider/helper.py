@@ -2,20 +2,25 @@ import asyncio
 import itertools
 import json
 import logging
+import math
 import mimetypes
-import random
+import os
 import re
+import shutil
+import threading
 import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from copy import deepcopy
 from pathlib import Path
-from typing import AsyncIterable
-from urllib.parse import unquote
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable
+from urllib.parse import unquote, urlparse
 
 import httpx
 import magic
 import pendulum
 from baseconv import base62
-from exiftool import ExifToolHelper
+from bs4 import BeautifulSoup
 from geopy.distance import geodesic
 from humanize import naturalsize
 from makelive import is_live_photo_pair, live_id, make_live_photo
@@ -26,38 +31,226 @@ from makelive.makelive import (
 from rich.prompt import Confirm
 
 from sinaspider import console
-from sinaspider.exceptions import DownloadFilesFailed, UserNotFoundError
+from sinaspider.cache import DeadUrls, ResponseCache, normalize_url
+from sinaspider.cassette import Cassette, CassetteTransport
+from sinaspider.exceptions import (
+    DownloadFilesFailed,
+    MediaExpired,
+    RequestFailed,
+    RetryLater,
+    UserNotFoundError
+)
+from sinaspider.hls import Playlist
+from sinaspider.journal import DownloadJournal
+from sinaspider.limiter import (
+    Backoff,
+    BandwidthLimiter,
+    CircuitBreaker,
+    HostLimiter,
+    Scheduler,
+    endpoint_family
+)
+from sinaspider.metadata import MetadataWriter
+from sinaspider.metrics import metrics
+from sinaspider.postprocess import PostProcessor
 
 httpx_logger = logging.getLogger("httpx")
 httpx_logger.disabled = True
 mime_detector = magic.Magic(mime=True)
 
 
+class ConnectionStats:
+    """
+    Count requests served on reused connections versus new handshakes.
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.connects = 0
+        self.handshakes = 0
+
+    @property
+    def reused(self) -> int:
+        return self.requests - self.connects
+
+    def __str__(self) -> str:
+        return (f'{self.requests} requests, {self.reused} on reused '
+                f'connections, {self.connects} new connections '
+                f'({self.handshakes} TLS handshakes)')
+
+    async def on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions['trace'] = self._trace
+
+    async def _trace(self, event: str, info: dict):
+        if event == 'connection.connect_tcp.complete':
+            self.connects += 1
+        elif event == 'connection.start_tls.complete':
+            self.handshakes += 1
+
+
+def new_client(limits: httpx.Limits,
+               timeout: httpx.Timeout,
+               http2_hosts: list[str] = (),
+               stats: ConnectionStats | None = None,
+               cassette: Cassette | None = None,
+               standin: str | None = None,
+               **kwargs) -> httpx.AsyncClient:
+    """
+    Create AsyncClient with pool tuning and HTTP/2 for http2_hosts.
+
+    Host pattern follows httpx mounts, e.g. 'api.weibo.cn', '*.sinaimg.cn'.
+    All traffic goes through cassette if given, and to the stand-in
+    server at url standin instead of weibo if given.
+    """
+    mounts = {}
+    if http2_hosts:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            console.log('h2 is not installed, using HTTP/1.1 '
+                        '(pip install httpx\\[http2])', style='warning')
+        else:
+            mounts = {f'https://{host}': httpx.AsyncHTTPTransport(
+                http2=True, limits=limits) for host in http2_hosts}
+    event_hooks = {'request': [stats.on_request]} if stats else None
+    if standin:
+        # only for load testing, kept off the import of the crawler
+        from sinaspider.standin import StandinTransport
+        kwargs['transport'] = StandinTransport(
+            standin, httpx.AsyncHTTPTransport(limits=limits))
+        mounts = {}
+    if cassette:
+        kwargs['transport'] = CassetteTransport(
+            cassette, kwargs.get('transport')
+            or httpx.AsyncHTTPTransport(limits=limits))
+        mounts = {pattern: CassetteTransport(cassette, transport)
+                  for pattern, transport in mounts.items()}
+    return httpx.AsyncClient(limits=limits, timeout=timeout,
+                             mounts=mounts, event_hooks=event_hooks,
+                             **kwargs)
+
+
+class Account:
+    """
+    A logged-in session with its own rate budget and health state.
+    """
+    REST_PERIOD = 600  # seconds to skip the account after being throttled
+
+    def __init__(self, name: str, sess: httpx.AsyncClient) -> None:
+        self.name = name
+        self.sess = sess
+        self.scheduler = Scheduler()
+        # requests waiting for their turn or in flight
+        self.inflight = 0
+        self._rest_until = 0
+
+    def __repr__(self) -> str:
+        return f'Account({self.name!r})'
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self._rest_until
+
+    def rest(self, reason: str):
+        self._rest_until = time.monotonic() + self.REST_PERIOD
+        console.log(
+            f'account {self.name} rests for {self.REST_PERIOD} seconds '
+            f'since {reason}', style='warning')
+
+    def load(self, url: str) -> float:
+        """
+        return pending work of the account for url, lower is idler
+        """
+        bucket = self.scheduler.bucket(endpoint_family(url))
+        return self.inflight - bucket.tokens
+
+
 class Fetcher:
+    LIMITS = httpx.Limits(max_connections=10,
+                          max_keepalive_connections=10,
+                          keepalive_expiry=300)
+    TIMEOUT = httpx.Timeout(30, connect=10)
+    HTTP2_HOSTS: list[str] = []
+    # tries of a request before RequestFailed is raised
+    MAX_ATTEMPTS = 10
+
     def __init__(self, art_login: bool | None = None) -> None:
-        self.sess_main, self.sess_art = self.get_session()
-        self._visit_count = 0
+        self.limits = self.LIMITS
+        self.timeout = self.TIMEOUT
+        self.http2_hosts = self.HTTP2_HOSTS
+        self.cassette: Cassette | None = None
+        self.standin: str | None = None
+        self.conn_stats = ConnectionStats()
+        self.accounts = self.get_accounts()
+        self.cache: ResponseCache | None = None
+        # where the learned request rates are kept across runs
+        self.rates_file: Path | None = None
         self.visits = 0
-        self._last_fetch = time.time()
-        self._art_login = art_login
+        # number of requests served by an identical in-flight request
+        self.collapsed = 0
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.backoff = Backoff()
+        self.breakers: dict[str, CircuitBreaker] = {}
+        # carried per task, so tasks working with different accounts
+        # can run concurrently without switching each other
+        self._art_login = ContextVar('art_login', default=art_login)
+        self._lane = ContextVar('lane', default='timeline')
 
-    def get_session(self):
-        user_agent = (
-            'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) '
-            'AppleWebKit/537.36 (KHTML, like Gecko) '
-            'Chrome/100.0.4896.75 Mobile Safari/537.36')
-        headers = {'User-Agent': user_agent}
+    def get_accounts(self) -> dict[str, Account]:
+        """
+        Load accounts from cookie.json.
 
+        The main and art accounts are used for requests depends on who is
+        logged in. Any other key of cookie.json is treated as an extra
+        account, which only serves the requests routed through pool.
+        """
         cookie_file = Path(__file__).with_name('cookie.json')
         if cookie_file.exists():
             cookies = json.loads(cookie_file.read_text())
         else:
             cookies = {}
-        sess_main = httpx.AsyncClient(
-            headers=headers, cookies=cookies.get('main'))
-        sess_art = httpx.AsyncClient(
-            headers=headers, cookies=cookies.get('art'))
-        return sess_main, sess_art
+        cookies = {'main': None, 'art': None} | cookies
+        return {name: Account(name, self._new_session(cookie))
+                for name, cookie in cookies.items()}
+
+    def _new_session(self, cookies) -> httpx.AsyncClient:
+        user_agent = (
+            'Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) '
+            'AppleWebKit/537.36 (KHTML, like Gecko) '
+            'Chrome/100.0.4896.75 Mobile Safari/537.36')
+        headers = {'User-Agent': user_agent}
+        return new_client(self.limits, self.timeout, self.http2_hosts,
+                          self.conn_stats, self.cassette, self.standin,
+                          headers=headers, cookies=cookies)
+
+    async def configure(self, limits: httpx.Limits | None = None,
+                        timeout: httpx.Timeout | None = None,
+                        http2_hosts: list[str] | None = None,
+                        cassette: Cassette | None = None,
+                        standin: str | None = None):
+        """
+        Rebuild sessions with new pool tuning, cookies are kept and the
+        old sessions closed.
+        """
+        self.limits = limits or self.limits
+        self.timeout = timeout or self.timeout
+        if http2_hosts is not None:
+            self.http2_hosts = http2_hosts
+        self.cassette = cassette or self.cassette
+        self.standin = standin or self.standin
+        for account in self.accounts.values():
+            sess = account.sess
+            account.sess = self._new_session(sess.cookies)
+            await sess.aclose()
+
+    @property
+    def sess_main(self) -> httpx.AsyncClient:
+        return self.accounts['main'].sess
+
+    @property
+    def sess_art(self) -> httpx.AsyncClient:
+        return self.accounts['art'].sess
 
     async def login(self, art_login: bool | None = None):
 
@@ -65,14 +258,16 @@ class Fetcher:
             if (art_login := self.art_login) is None:
                 raise ValueError('art_login is not set')
         sess = self.sess_art if art_login else self.sess_main
-        url = (
-            "https://api.weibo.cn/2/profile/me?launchid=10000365--x&from=10D9293010&c=iphone")
         s = '694a9ce0' if art_login else '537c037e'
+        url = ("https://api.weibo.cn/2/profile/me?launchid=10000365--x"
+               f"&from=10D9293010&c=iphone&s={s}")
         while True:
-            js = await self.get_json(url, art_login, params={'s': s})
+            js = await self.get_json(url, art_login)
             if not js.get('errmsg'):
                 break
             console.log(f'fetch {url} error: {js}', style='error')
+            self._throttled(self.accounts['art' if art_login else 'main'],
+                            url)
             console.log(
                 f'cookie expired, relogin...(art_login={art_login})',
                 style='error')
@@ -93,146 +288,421 @@ class Fetcher:
 
     def save_cookie(self):
         cookie_file = Path(__file__).with_name('cookie.json')
-        cookies = dict(
-            main={c.name: c.value for c in self.sess_main.cookies.jar},
-            art={c.name: c.value for c in self.sess_art.cookies.jar})
+        cookies = {name: {c.name: c.value for c in account.sess.cookies.jar}
+                   for name, account in self.accounts.items()}
         cookie_file.write_text(json.dumps(cookies))
 
+    def load_rates(self, rates_file: Path):
+        """
+        restore the request rates learned by previous runs
+        """
+        self.rates_file = rates_file
+        if not rates_file.exists():
+            return
+        rates = json.loads(rates_file.read_text())
+        for name, account in self.accounts.items():
+            account.scheduler.restore(rates.get(name, {}))
+
+    def save_rates(self):
+        if not self.rates_file:
+            return
+        rates = {}
+        if self.rates_file.exists():
+            rates = json.loads(self.rates_file.read_text())
+        for name, account in self.accounts.items():
+            if state := account.scheduler.state():
+                rates[name] = state
+        self.rates_file.parent.mkdir(parents=True, exist_ok=True)
+        self.rates_file.write_text(json.dumps(rates, indent=2))
+
+    def _throttled(self, account: Account, url: str):
+        account.scheduler.throttled(url)
+        self.save_rates()
+
     @property
-    def art_login(self):
-        return self._art_login
+    def art_login(self) -> bool | None:
+        return self._art_login.get()
 
     async def toggle_art(self, on: bool = True) -> None:
-        if self._art_login == on:
+        """
+        switch account for the current task and the tasks it creates
+        """
+        if self.art_login == on:
             return
-        self._art_login = on
+        self._art_login.set(on)
         screen_name = await self.login(art_login=on)
         console.log(
             f'fetcher: current logined as {screen_name} (is_art:{on})',
             style='notice')
 
+    def set_lane(self, lane: str):
+        """
+        set the lane of Scheduler.LANES for requests of the current task
+        and the tasks it creates
+        """
+        if lane not in Scheduler.LANES:
+            raise ValueError(f'unknown lane: {lane}')
+        self._lane.set(lane)
+
+    def _pick(self, url: str) -> Account:
+        """
+        pick the least-loaded healthy account for url
+        """
+        accounts = [a for a in self.accounts.values() if a.healthy]
+        return min(accounts or self.accounts.values(),
+                   key=lambda a: a.load(url))
+
     async def request(self, method, url: str,
                       art_login: bool | None = None,
+                      pool: bool = False,
+                      check: Callable[[httpx.Response], str | None] = None,
+                      lane: str | None = None,
                       **kwargs) -> httpx.Response:
-        # write with session and pause
-        if art_login is None:
-            if self.art_login is None:
-                console.log(
-                    'art_login is not set, set to True', style='warning')
-                await self.toggle_art(True)
-            art_login = self.art_login
+        """
+        Args:
+            art_login: request with art account or main account
+            pool: route to the least-loaded healthy account instead,
+                only for response not depends on who is logged in
+            check: return error message if the response should be
+                retried, in addition to the errors found by soft_error
+            lane: lane of the request waiting for its turn, default to
+                the one set by set_lane
+        """
+        lane = lane or self._lane.get()
+        if pool:
+            route = 'pool'
+        else:
+            if art_login is None:
+                if self.art_login is None:
+                    console.log(
+                        'art_login is not set, set to True', style='warning')
+                    await self.toggle_art(True)
+                art_login = self.art_login
+            route = 'art' if art_login else 'main'
+        if method.lower() != 'get':
+            return await self._request(
+                route, method, url, check, lane, **kwargs)
+
+        # concurrent callers of the same request share one in-flight
+        key = (route, normalize_url(url, kwargs.get('params')), repr(check),
+               repr(sorted((k, v) for k, v in kwargs.items()
+                           if k != 'params')))
+        if task := self._inflight.get(key):
+            self.collapsed += 1
+        else:
+            task = asyncio.create_task(
+                self._request(route, method, url, check, lane, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key))
+        # shield so that a cancelled caller won't cancel the others
+        return await asyncio.shield(task)
 
-        await self._pause()
-        s = self.sess_art if art_login else self.sess_main
+    async def _request(self, route: str, method, url: str,
+                       check=None, lane='timeline',
+                       **kwargs) -> httpx.Response:
+        breaker = self.breaker(url)
+        family = endpoint_family(url)
+        attempt = 0
         while True:
+            # write with session and pause
+            if waited := await breaker.wait():
+                metrics.observe('wait_seconds', waited, client='fetcher',
+                                family=family, reason='breaker')
+            if route == 'pool':
+                account = self._pick(url)
+            else:
+                account = self.accounts[route]
+            # counted while waiting, so that load() sees the backlog
+            account.inflight += 1
             try:
-                r = await s.request(method, url, **kwargs)
+                await self._pause(account, url, lane)
+                start = time.monotonic()
+                r = await account.sess.request(method, url, **kwargs)
+                _observe_response('fetcher', family, start, r)
                 r.raise_for_status()
             except asyncio.CancelledError:
                 console.log(f'{method} {url}  was cancelled.', style='error')
                 raise
+            except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                if throttled := _is_throttled(e.response):
+                    self._throttled(account, url)
+                if route == 'pool' and throttled:
+                    # retry with another account
+                    metrics.inc('retries_total', client='fetcher',
+                                family=family, error='throttled')
+                    account.rest(f'{status} for {url}')
+                    if (attempt := attempt + 1) >= self.MAX_ATTEMPTS:
+                        raise RequestFailed(
+                            f'{e!r} after {attempt} attempts', url)
+                    continue
+                if 400 <= status < 500 and not throttled:
+                    # e.g. 404 won't go away by retrying
+                    raise
+                error, kind = repr(e), f'status_{status}'
             except httpx.HTTPError as e:
-                period = 10 if isinstance(e, httpx.ConnectError) else 60
-                console.log(
-                    f"{e!r}: sleep {period} seconds and "
-                    f"retry [link={url}]{url}[/link]...", style='error')
-                await asyncio.sleep(period)
+                error, kind = repr(e), type(e).__name__
             else:
-                assert r.status_code == 200
-                return r
+                if error := soft_error(r):
+                    kind = 'soft_error'
+                    self._throttled(account, url)
+                elif error := (check and check(r)):
+                    kind = 'check'
+                else:
+                    breaker.success()
+                    account.scheduler.success(url)
+                    return r
+            finally:
+                account.inflight -= 1
+            # the failed check is about the url, not the endpoint family
+            if kind != 'check':
+                breaker.failure()
+            metrics.inc('retries_total', client='fetcher',
+                        family=family, error=kind)
+            if (attempt := attempt + 1) >= self.MAX_ATTEMPTS:
+                raise RequestFailed(
+                    f'{error} after {attempt} attempts', url)
+            period = self.backoff.delay(attempt - 1)
+            console.log(
+                f"{error}: sleep {period:.0f} seconds and "
+                f"retry [link={url}]{url}[/link]...", style='error')
+            metrics.observe('wait_seconds', period, client='fetcher',
+                            family=family, reason='backoff')
+            await asyncio.sleep(period)
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        family = endpoint_family(url)
+        if family not in self.breakers:
+            self.breakers[family] = CircuitBreaker(family)
+        return self.breakers[family]
 
     async def get(self, url: str, art_login: bool = None,
-                  **kwargs) -> httpx.Response:
-        return await self.request('get', url, art_login, **kwargs)
+                  pool: bool = False, **kwargs) -> httpx.Response:
+        return await self.request('get', url, art_login, pool, **kwargs)
 
     async def get_json(self, url: str, art_login: bool = None,
+                       pool: bool = False, cache: bool = True,
                        **kwargs) -> dict:
-        r = await self.request('get', url, art_login, **kwargs)
-        return r.json()
+        """
+        Args:
+            cache: whether look up the response cache, only urls with
+                ttl in ResponseCache.TTLS are cached
+        """
+        key = normalize_url(url, kwargs.get('params'))
+        if not (cache and self.cache and self.cache.ttl(key)):
+            r = await self.request('get', url, art_login, pool, **kwargs)
+            return r.json()
+        if pool:
+            account = 'pool'
+        elif art_login is False or (art_login is None
+                                    and self.art_login is False):
+            account = 'main'
+        else:
+            account = 'art'
+        if (body := self.cache.get(key, account)) is not None:
+            return json.loads(body)
+        r = await self.request('get', url, art_login, pool, **kwargs)
+        js = r.json()
+        if isinstance(js, dict) and js.get('ok', 1) and not js.get('errmsg'):
+            self.cache.set(key, account, r.content)
+        return js
+
+    def invalidate(self, pattern: str):
+        """
+        drop cached responses whose url contains pattern
+        """
+        if self.cache:
+            self.cache.invalidate(pattern)
 
     async def post(self, url: str, art_login: bool = None,
                    **kwargs) -> httpx.Response:
         return await self.request('post', url, art_login, **kwargs)
 
-    async def _pause(self):
+    async def _pause(self, account: Account, url: str, lane: str):
         self.visits += 1
-        if self._visit_count == 0:
-            self._visit_count = 1
-            self._last_fetch = time.time()
+        waited = await account.scheduler.acquire(url, lane)
+        metrics.observe('wait_seconds', waited, client='fetcher',
+                        family=endpoint_family(url), reason='pacing')
+        metrics.observe('lane_wait_seconds', waited, lane=lane)
+
+
+def _observe_response(client: str, family: str, start: float,
+                      r: httpx.Response):
+    metrics.observe('request_seconds', time.monotonic() - start,
+                    client=client, family=family)
+    metrics.observe('response_bytes', r.num_bytes_downloaded,
+                    client=client, family=family)
+    metrics.inc('responses_total', client=client, family=family,
+                status=r.status_code)
+
+
+# error messages which clear by themselves after a while
+TRANSIENT_ERRORS = ['请求超时', 'Redis执行失败', '繁忙', '频繁']
+
+
+def soft_error(r: httpx.Response) -> str | None:
+    """
+    return the transient error hidden in a 200 response, if any
+    """
+    if 'json' in r.headers.get('content-type', ''):
+        if b'errmsg' not in r.content:
             return
-        for flag in [2048, 1024, 256, 64, 16]:
-            if self._visit_count % flag == 0:
-                sleep_time = flag
-                break
-        else:
-            sleep_time = 1
-        sleep_time *= random.uniform(0.5, 1.5)
-        self._last_fetch += sleep_time
-        if (wait_time := (self._last_fetch-time.time())) > 0:
-            console.log(
-                f'sleep {wait_time:.1f} seconds...'
-                f'(count: {self._visit_count})',
-                style='info')
-        elif wait_time < -3600:
-            self._visit_count = 0
-            console.log(
-                f'reset visit count to {self._visit_count} since have '
-                f'no activity for {-wait_time:.1f} seconds, '
-                'which means more than 1 hour passed')
-        else:
-            console.log(
-                f'no sleeping since more than {sleep_time:.1f} seconds passed'
-                f'(count: {self._visit_count})')
-        while time.time() < self._last_fetch:
-            try:
-                await asyncio.sleep(0.1)
-            except asyncio.CancelledError:
-                console.log('Cancelled on sleep', style='error')
-                raise KeyboardInterrupt
-        self._last_fetch = time.time()
-        self._visit_count += 1
+        if not isinstance(js := r.json(), dict):
+            return
+        if (err_msg := str(js.get('errmsg'))) and any(
+                e in err_msg for e in TRANSIENT_ERRORS):
+            return f'errmsg: {err_msg}'
+    elif '<title>微博-出错了</title>' in r.text:
+        soup = BeautifulSoup(r.text, 'html.parser')
+        err_msg = soup.body.p.text.strip()
+        if any(e in err_msg for e in TRANSIENT_ERRORS):
+            return f'微博-出错了: {err_msg}'
+
+
+def _is_throttled(r: httpx.Response) -> bool:
+    """
+    whether the response means the account is throttled or logged out
+    """
+    if r.status_code in [403, 418, 429]:
+        return True
+    return r.is_redirect and 'passport' in r.headers.get('location', '')
 
 
 class HttpClient:
+    # concurrency is limited per host by HostLimiter
+    LIMITS = httpx.Limits(max_connections=128,
+                          max_keepalive_connections=128,
+                          keepalive_expiry=60)
+    TIMEOUT = httpx.Timeout(60, connect=10, pool=60)
+    HTTP2_HOSTS: list[str] = []
+    # consecutive pool timeouts before the pool is considered stuck
+    MAX_POOL_TIMEOUTS = 5
+
     def __init__(self):
-        self._client = httpx.AsyncClient(follow_redirects=True)
+        self.limits = self.LIMITS
+        self.timeout = self.TIMEOUT
+        self.http2_hosts = self.HTTP2_HOSTS
+        self.cassette: Cassette | None = None
+        self.standin: str | None = None
+        self.conn_stats = ConnectionStats()
+        self.limiter = HostLimiter()
+        self.bandwidth = BandwidthLimiter()
+        # where download_files keeps track of its items, if set
+        self.journal: DownloadJournal | None = None
+        self.dead_urls: DeadUrls | None = None
+        self._client = self._new_client()
         self._lock = asyncio.Lock()
+        self._pool_timeouts = 0
+
+    def _new_client(self) -> httpx.AsyncClient:
+        return new_client(self.limits, self.timeout, self.http2_hosts,
+                          self.conn_stats, self.cassette, self.standin,
+                          follow_redirects=True)
+
+    async def configure(self, limits: httpx.Limits | None = None,
+                        timeout: httpx.Timeout | None = None,
+                        http2_hosts: list[str] | None = None,
+                        cassette: Cassette | None = None,
+                        standin: str | None = None):
+        self.limits = limits or self.limits
+        self.timeout = timeout or self.timeout
+        if http2_hosts is not None:
+            self.http2_hosts = http2_hosts
+        self.cassette = cassette or self.cassette
+        self.standin = standin or self.standin
+        async with self._lock:
+            old_client, self._client = self._client, self._new_client()
+            self._pool_timeouts = 0
+            await old_client.aclose()
 
     async def _recreate_client(self, old_client):
         async with self._lock:
             if self._client is old_client:
                 console.log('recreating client...', style='error')
-                self._client = httpx.AsyncClient(follow_redirects=True)
+                self._client = self._new_client()
+                self._pool_timeouts = 0
                 await old_client.aclose()
 
-    async def get(self, url):
+    async def get(self, url) -> httpx.Response:
+        async with self.stream(url) as r:
+            await r.aread()
+        return r
+
+    @asynccontextmanager
+    async def stream(self, url, headers: dict | None = None):
+        """
+        Send GET request, yield the response with body not read yet.
+
+        The request takes a slot of its host from limiter till closed.
+        """
+        family = endpoint_family(url)
+        waited = await self.limiter.acquire(url)
+        metrics.observe('wait_seconds', waited, client='download',
+                        family=family, reason='slot')
+        r, failed, latency = None, False, 0
+        try:
+            r, start = await self._send(url, headers, family)
+            latency = time.monotonic() - start
+            failed = r.status_code == 429 or r.status_code >= 500
+            try:
+                yield r
+            finally:
+                await r.aclose()
+                _observe_response('download', family, start, r)
+        except httpx.TransportError:
+            failed = True
+            raise
+        finally:
+            self.limiter.release(url, failed, latency,
+                                 r.num_bytes_downloaded if r else 0)
+
+    async def _send(self, url, headers: dict | None,
+                    family: str) -> tuple[httpx.Response, float]:
+        """
+        return the response and when the request started
+        """
         while True:
             client = self._client
+            start = time.monotonic()
             try:
-                return await client.get(url)
+                request = client.build_request('GET', url, headers=headers)
+                r = await client.send(request, stream=True)
             except httpx.PoolTimeout:
-                await self._recreate_client(client)
+                metrics.inc('retries_total', client='download',
+                            family=family, error='PoolTimeout')
+                # keep the warm connections unless the pool seems stuck
+                self._pool_timeouts += 1
+                if self._pool_timeouts >= self.MAX_POOL_TIMEOUTS:
+                    await self._recreate_client(client)
+                else:
+                    console.log(f'pool timeout for {url}, retrying...',
+                                style='warning')
             except Exception:
                 if not client.is_closed:
                     raise
+            else:
+                self._pool_timeouts = 0
+                return r, start
 
 
 fetcher = Fetcher()
 client = HttpClient()
-et = ExifToolHelper()
-semaphore = asyncio.Semaphore(60)
-
-
-def write_xmp(img: Path, tags: dict):
-    for k, v in tags.copy().items():
-        if isinstance(v, str):
-            tags[k] = v.replace('\n', '&#x0a;')
-    params = ['-overwrite_original', '-ignoreMinorErrors', '-escapeHTML']
-    ext = et.get_tags(img, 'File:FileTypeExtension')[
-        0]['File:FileTypeExtension'].lower()
-    if (suffix := f'.{ext}') != img.suffix:
-        raise ValueError(f'{img} suffix is not right: {suffix}')
-    et.set_tags(img, tags, params=params)
+postprocessor = PostProcessor()
+metadata = MetadataWriter(postprocessor)
+# makelive runs exiftool of its own, which is not thread safe
+live_lock = threading.Lock()
+# bytes held in memory per download
+CHUNK_SIZE = 1 << 16
+# files larger than this are downloaded in concurrent ranges
+RANGED_THRESHOLD = 32 << 20
+RANGE_SIZE = 8 << 20
+RANGES_PER_FILE = 4
+RANGE_RETRIES = 5
+# imgs downloaded at the same time by download_files
+DOWNLOAD_WORKERS = 60
+# set in download_files, which reschedules the waiting retries and
+# re-resolves the expired urls
+_queued = ContextVar('queued', default=False)
 
 
 async def download_file_pair(medias: list[dict]):
@@ -246,6 +716,9 @@ async def download_file_pair(medias: list[dict]):
     try:
         img_path = await download_single_file(**img_info)
         mov_path = await download_single_file(**mov_info)
+    except (RetryLater, MediaExpired):
+        # the one downloaded is skipped on retry
+        raise
     except Exception:
         if (img_path := img_info['filepath']/img_info['filename']).exists():
             img_path.unlink()
@@ -254,171 +727,649 @@ async def download_file_pair(medias: list[dict]):
         raise
     if mov_path is None or mov_path.suffix not in {'.mov', '.mp4'}:
         console.log(f'live mov download failed: {mov_info}', style='error')
-        write_xmp(img_path, img_xmp)
+        await metadata.write(img_path, img_xmp)
         if mov_path:
-            write_xmp(mov_path, mov_xmp)
+            await metadata.write(mov_path, mov_xmp)
         return
-    img_size = naturalsize(img_path.stat().st_size)
-    mov_size = naturalsize(mov_path.stat().st_size)
-    if not is_live_photo_pair(img_path, mov_path):
-        # assert not (live_id(img_path) and live_id(mov_path))
-        console.log(
-            f'not live photo pair: {img_path} {mov_path}, fixing...',
-            style='info')
-        if assert_id := live_id(img_path):
-            add_asset_id_to_quicktime_file(mov_path, assert_id)
-        elif assert_id := live_id(mov_path):
-            add_asset_id_to_image_file(img_path, assert_id)
-        else:
-            make_live_photo(img_path, mov_path)
-    if (x := naturalsize(img_path.stat().st_size)) != img_size:
-        console.log(f'{img_path.name} size changed from {img_size} to {x}')
-    if (x := naturalsize(mov_path.stat().st_size)) != mov_size:
-        console.log(f'{mov_path.name} size changed from {mov_size} to {x}')
-    assert is_live_photo_pair(img_path, mov_path)
-    write_xmp(img_path, img_xmp)
-    write_xmp(mov_path, mov_xmp)
+    await postprocessor.run('live', _fix_live_photo, img_path, mov_path)
+    await metadata.write(img_path, img_xmp)
+    await metadata.write(mov_path, mov_xmp)
+
+
+def _fix_live_photo(img_path: Path, mov_path: Path):
+    """
+    blocking, call it by postprocessor.run
+    """
+    with live_lock:
+        img_size = naturalsize(img_path.stat().st_size)
+        mov_size = naturalsize(mov_path.stat().st_size)
+        if not is_live_photo_pair(img_path, mov_path):
+            # assert not (live_id(img_path) and live_id(mov_path))
+            console.log(
+                f'not live photo pair: {img_path} {mov_path}, fixing...',
+                style='info')
+            if assert_id := live_id(img_path):
+                add_asset_id_to_quicktime_file(mov_path, assert_id)
+            elif assert_id := live_id(mov_path):
+                add_asset_id_to_image_file(img_path, assert_id)
+            else:
+                make_live_photo(img_path, mov_path)
+        if (x := naturalsize(img_path.stat().st_size)) != img_size:
+            console.log(f'{img_path.name} size changed '
+                        f'from {img_size} to {x}')
+        if (x := naturalsize(mov_path.stat().st_size)) != mov_size:
+            console.log(f'{mov_path.name} size changed '
+                        f'from {mov_size} to {x}')
+        assert is_live_photo_pair(img_path, mov_path)
+
+
+async def _write_part(part: Path, head: bytes,
+                      chunks: AsyncIterator[bytes],
+                      length: int, offset: int = 0) -> int:
+    """
+    Write head and the rest chunks to part after offset, return the size
+    of part.
+
+    Stop as soon as part grows over length, and remove it in that case.
+    """
+    size, elapsed = offset, 0
+    try:
+        with part.open('ab' if offset else 'wb') as f:
+            chunk = head
+            while chunk and size <= length:
+                start = time.monotonic()
+                f.write(chunk)
+                elapsed += time.monotonic() - start
+                size += len(chunk)
+                chunk = await anext(chunks, b'')
+    finally:
+        metrics.observe('disk_seconds', elapsed, op='write')
+        if size > length:
+            part.unlink(missing_ok=True)
+    return size
+
+
+def _resume_headers(part: Path, url: str) -> dict:
+    """
+    Range headers to continue part, empty if it cannot be resumed.
+    """
+    meta = part.with_name(part.name + '.json')
+    if not (part.exists() and meta.exists()):
+        return {}
+    validator = json.loads(meta.read_text())
+    if validator['url'] != url:
+        return {}
+    return {'Range': f'bytes={part.stat().st_size}-',
+            'If-Range': validator['etag'] or validator['last_modified']}
+
+
+def _save_validator(part: Path, url: str, r: httpx.Response):
+    """
+    Keep what is needed to resume part of url later, if the server allows.
+
+    url is the one requested, which _resume_headers is asked with, not
+    where it redirects to.
+    """
+    meta = part.with_name(part.name + '.json')
+    etag = r.headers.get('ETag')
+    last_modified = r.headers.get('Last-Modified')
+    if r.headers.get('Accept-Ranges') == 'bytes' and (etag or last_modified):
+        meta.write_text(json.dumps(
+            dict(url=url, etag=etag,
+                 last_modified=last_modified)))
+    else:
+        meta.unlink(missing_ok=True)
+
+
+async def _download_ranges(url: str, part: Path, length: int,
+                           validator: str | None) -> int:
+    """
+    Download url of length into part by concurrent ranges, return the
+    bytes downloaded.
+
+    Each range takes a download slot and retries by itself, from where
+    it broke off.
+    """
+    part.with_name(part.name + '.json').unlink(missing_ok=True)
+    with part.open('wb') as f:
+        f.truncate(length)
+    console.log(f'downloading {part.stem} ({naturalsize(length)}) in '
+                f'{RANGE_SIZE >> 20}MB ranges...', style='info')
+    family = endpoint_family(url)
+    limit = asyncio.Semaphore(RANGES_PER_FILE)
+
+    async def download_range(first: int, last: int) -> int:
+        done, elapsed = 0, 0
+        async with limit:
+            for i in range(RANGE_RETRIES):
+                if done > last - first:
+                    break
+                if i:
+                    await asyncio.sleep(period := 2 ** i)
+                    metrics.observe('wait_seconds', period, client='download',
+                                    family=family, reason='backoff')
+                headers = {'Range': f'bytes={first + done}-{last}'}
+                if validator:
+                    headers['If-Range'] = validator
+                fd = os.open(part, os.O_WRONLY)
+                try:
+                    async with client.stream(url, headers=headers) as r:
+                        if r.status_code != 206:
+                            metrics.inc('retries_total', client='download',
+                                        family=family,
+                                        error=f'status_{r.status_code}')
+                            continue
+                        async for chunk in client.bandwidth.shape(
+                                r.aiter_bytes(CHUNK_SIZE), url):
+                            chunk = chunk[:last - first + 1 - done]
+                            start = time.monotonic()
+                            os.pwrite(fd, chunk, first + done)
+                            elapsed += time.monotonic() - start
+                            if (done := done + len(chunk)) > last - first:
+                                break
+                except httpx.HTTPError as e:
+                    metrics.inc('retries_total', client='download',
+                                family=family, error=type(e).__name__)
+                finally:
+                    os.close(fd)
+        metrics.observe('disk_seconds', elapsed, op='write')
+        return done
+
+    sizes = await asyncio.gather(*[
+        download_range(first, min(first + RANGE_SIZE, length) - 1)
+        for first in range(0, length, RANGE_SIZE)])
+    return sum(sizes)
+
+
+async def _download_segment(url: str, dest: Path) -> bool:
+    """
+    download url to dest with retries, return whether succeed
+    """
+    family = endpoint_family(url)
+    part = dest.with_name(dest.name + '.part')
+    for i in range(RANGE_RETRIES):
+        if i:
+            await asyncio.sleep(period := 2 ** i)
+            metrics.observe('wait_seconds', period, client='download',
+                            family=family, reason='backoff')
+        try:
+            async with client.stream(url) as r:
+                if r.status_code != 200:
+                    metrics.inc('retries_total', client='download',
+                                family=family,
+                                error=f'status_{r.status_code}')
+                    continue
+                chunks = client.bandwidth.shape(
+                    r.aiter_bytes(CHUNK_SIZE), url)
+                length = int(r.headers.get('Content-Length', 0))
+                # without Content-Length, take whatever received
+                size = await _write_part(
+                    part, await anext(chunks, b''), chunks,
+                    length or math.inf)
+                if length and size != length:
+                    metrics.inc('retries_total', client='download',
+                                family=family, error='truncated')
+                    continue
+        except httpx.HTTPError as e:
+            metrics.inc('retries_total', client='download',
+                        family=family, error=type(e).__name__)
+            continue
+        part.replace(dest)
+        return True
+    return False
+
+
+async def _get_playlist(url: str) -> Playlist:
+    """
+    fetch the media playlist of url, pick the best variant if master
+    """
+    for _ in range(2):
+        for i in range(RANGE_RETRIES):
+            try:
+                r = (await client.get(url)).raise_for_status()
+                break
+            except httpx.HTTPError:
+                if i == RANGE_RETRIES - 1:
+                    raise
+                await asyncio.sleep(2 ** i)
+        playlist = Playlist(r.text, str(r.url))
+        if not playlist.is_master:
+            return playlist
+        url = playlist.best_variant()
+    raise ValueError(f'nested master playlist: {url}')
+
+
+async def download_hls(url: str, filepath: Path, filename: str,
+                       xmp_info: dict = None) -> Path:
+    """
+    Download the HLS stream of url into filepath/filename.
+
+    Segments are fetched concurrently into filename.segments, which is
+    kept if some of them failed, so the next run only fetches the rest.
+    They are joined without re-encoding: fmp4 segments make a mp4 as
+    is, ts segments are remuxed by ffmpeg. Without ffmpeg, ts streams
+    fail with the segments kept for a run with it.
+    """
+    img = filepath / filename
+    playlist = await _get_playlist(url)
+    if playlist.encrypted:
+        raise ValueError(f'encrypted HLS is not supported: {url}')
+    segments = ([playlist.init] if playlist.init else []) + playlist.segments
+    seg_dir = filepath / f'{filename}.segments'
+    seg_dir.mkdir(exist_ok=True)
+    dests = [seg_dir / f'{i:05d}' for i in range(len(segments))]
+    console.log(f'downloading {img.name} in {len(segments)} segments...',
+                style='info')
+    limit = asyncio.Semaphore(RANGES_PER_FILE)
+
+    async def download(seg: str, dest: Path) -> bool:
+        if dest.exists():
+            return True
+        async with limit:
+            return await _download_segment(seg, dest)
+    done = await asyncio.gather(*map(download, segments, dests))
+    if not all(done):
+        console.log(f'{done.count(False)} of {len(segments)} segments '
+                    f'failed for {img}', style='error')
+        raise ValueError(f'cannot download {url} for {img}')
+    if not (playlist.init or shutil.which('ffmpeg')):
+        raise ValueError(f'ffmpeg is required to remux the ts segments '
+                         f'of {url}, kept in {seg_dir}')
+
+    joined = filepath / f'{filename}.joined'
+    await postprocessor.run('join', _join_segments, dests, joined)
+    if playlist.init:
+        img = img.with_suffix('.mp4')
+    else:
+        part = filepath / f'{filename}.part'
+        proc = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-y', '-loglevel', 'error', '-f', 'mpegts',
+            '-i', joined, '-c', 'copy', '-f', 'mp4', part)
+        if await proc.wait():
+            part.unlink(missing_ok=True)
+            raise ValueError(f'ffmpeg failed to remux {joined}')
+        joined.unlink()
+        joined = part
+        img = img.with_suffix('.mp4')
+    joined.replace(img)
+    shutil.rmtree(seg_dir)
+
+    if xmp_info:
+        await metadata.write(img, xmp_info)
+    console.log(f'successfully downloaded: {img}...', style="dim")
+    return img
+
+
+def _join_segments(dests: list[Path], joined: Path):
+    with joined.open('wb') as f:
+        for dest in dests:
+            with dest.open('rb') as seg:
+                shutil.copyfileobj(seg, f, CHUNK_SIZE)
+
+
+def _drop_part(part: Path, keep_resumable: bool = False):
+    meta = part.with_name(part.name + '.json')
+    if keep_resumable and meta.exists():
+        return
+    part.unlink(missing_ok=True)
+    meta.unlink(missing_ok=True)
+
+
+def _expires(url: str) -> int | None:
+    """
+    timestamp the signed url expires at
+    """
+    if match := re.search(r'[\?&]Expires=(\d+)(&|$)', url):
+        return int(match.group(1))
 
 
 async def download_single_file(
         url: str,
         filepath: Path,
         filename: str,
-        xmp_info: dict = None
+        xmp_info: dict = None,
+        attempt: int = 0,
 ) -> Path | None:
+    """
+    Download url to filepath/filename, suffix is corrected by the content.
+
+    The body is written to filename.part, which is kept when the
+    transfer breaks off, and continued with Range request the next
+    time, even by another process.
+
+    Under download_files, RetryLater is raised instead of waiting for
+    the next try, which then continues from attempt, and MediaExpired
+    is raised for expired url instead of skipping it.
+    """
     filepath.mkdir(parents=True, exist_ok=True)
     img = filepath / filename
     if img.exists():
         console.log(f'{img} already exists..skipping...', style='info')
         return img
-    if match := re.search(r'[\?&]Expires=(\d+)(&|$)', url):
-        expires = pendulum.from_timestamp(int(match.group(1)), tz='local')
-        if expires < pendulum.now():
-            console.log(
-                f"{filename}: {url} expires at {expires}, skip...",
-                style="warning")
-            return
-    for i in range(10):
-        async with semaphore:
-            if i:
-                period = 60
-                await asyncio.sleep(period)
-            try:
-                r = await client.get(url)
-            except httpx.HTTPError as e:
-                if i > 0:
-                    console.log(f'download img {img} failed with {e!r} ({url})...'
-                                f' retry in {period} seconds...(has tried {i} time(s))',
+    if (expires := _expires(url)) and expires < time.time():
+        expires = pendulum.from_timestamp(expires, tz='local')
+        if _queued.get():
+            raise MediaExpired(url, expires)
+        console.log(
+            f"{filename}: {url} expires at {expires}, skip...",
+            style="warning")
+        return
+    if client.dead_urls and url in client.dead_urls:
+        console.log(f'{filename}: {url} is dead, skip...', style='info')
+        client.dead_urls.skipped += 1
+        return
+    if urlparse(url).path.endswith('.m3u8'):
+        return await download_hls(url, filepath, filename, xmp_info)
+    family = endpoint_family(url)
+    part = filepath / f'{filename}.part'
+    progressed = False
+    for i in range(attempt, 10):
+        # no need to wait if the last try got something
+        if i > attempt and not progressed:
+            period = 60
+            metrics.observe('wait_seconds', period, client='download',
+                            family=family, reason='backoff')
+            if _queued.get():
+                raise RetryLater(url, i, period)
+            await asyncio.sleep(period)
+        progressed = ranged = False
+        headers = _resume_headers(part, url)
+        try:
+            async with client.stream(url, headers=headers) as r:
+                if r.status_code not in [200, 206]:
+                    metrics.inc('retries_total', client='download',
+                                family=family,
+                                error=f'status_{r.status_code}')
+                if r.status_code == 416:
+                    console.log(f'cannot resume {part}, restarting...',
+                                style='warning')
+                    _drop_part(part)
+                    progressed = True
+                    continue
+                if r.status_code in [404, 403]:
+                    if i == 0:
+                        continue
+                    elif i < 3:
+                        console.log(f'{url} {r.status_code} ERROR, '
+                                    f'has tried {i} time(s)', style='error')
+                        continue
+                    else:
+                        console.log(
+                            f"failed downloading {url}, "
+                            f"{xmp_info or img}, {r.status_code}",
+                            style="error")
+                        if client.dead_urls and r.status_code == 404:
+                            client.dead_urls.add(url, '404')
+                        return
+                elif r.status_code not in [200, 206]:
+                    console.log(f"{url}, {r.status_code}", style="error")
+                    console.log(f'retrying download for {url}...')
+                    continue
+
+                chunks = client.bandwidth.shape(
+                    r.aiter_bytes(CHUNK_SIZE), url)
+                first = await anext(chunks, b'')
+                if r.status_code == 206:
+                    offset, _, length = map(int, re.match(
+                        r'bytes (\d+)-(\d+)/(\d+)',
+                        r.headers['Content-Range']).groups())
+                    if offset != part.stat().st_size:
+                        _drop_part(part)
+                        continue
+                    with part.open('rb') as f:
+                        head = f.read(CHUNK_SIZE) + first
+                    console.log(
+                        f'resuming {img.name} from '
+                        f'{naturalsize(offset)}/{naturalsize(length)}',
+                        style='info')
+                    metrics.inc('resumed_bytes', offset,
+                                client='download', family=family)
+                else:
+                    offset, head = 0, first
+                    length = int(r.headers['Content-Length'])
+                    _save_validator(part, url, r)
+
+                mime_type = mime_detector.from_buffer(head)
+                if mime_type != 'application/octet-stream':
+                    suffix = mimetypes.guess_extension(mime_type)
+                else:
+                    suffix = img.suffix
+                if suffix == '.gif':
+                    assert r.url.path.endswith('.gif')
+                    if not url.endswith('.gif'):
+                        assert r.url.path.endswith(
+                            ('/images/default_d_h_large.gif',
+                             '/images/default_d_w_large.gif',
+                             '/images/default_d_s_large.gif',
+                             '/images/default_w_large.gif',
+                             '/images/default_h_large.gif',
+                             '/images/default_s_large.gif',)), r.url.path
+                        if i == 0:
+                            continue
+                        elif i < 5:
+                            console.log(
+                                f"{url} shouldn't be gif, "
+                                f"but redirected to {r.url} "
+                                f"(has tried {i} time(s))",
                                 style='error')
-                continue
+                            continue
+                        else:
+                            console.log(
+                                f'{img}: seems be deleted ({url})',
+                                style='error')
+                            if client.dead_urls:
+                                client.dead_urls.add(
+                                    url, f'redirected to {r.url.path}')
+                    img = img.with_suffix('.gif')
 
-        if r.status_code in [404, 403]:
-            if i == 0:
-                continue
-            elif i < 3:
-                console.log(f'{url} {r.status_code} ERROR, has tried {i} time(s)',
-                            style='error')
-                continue
-            else:
-                console.log(
-                    f"failed downloading {url}, {xmp_info or img}, {r.status_code}", style="error")
-                return
-        elif r.status_code != 200:
-            console.log(f"{url}, {r.status_code}", style="error")
-            console.log(f'retrying download for {url}...')
-            continue
+                elif img.suffix != suffix:
+                    console.log(f"{img}: suffix should be {suffix}",
+                                style="warning")
+                    img = img.with_suffix(suffix)
 
-        mime_type = mime_detector.from_buffer(r.content)
-        if mime_type != 'application/octet-stream':
-            suffix = mimetypes.guess_extension(mime_type)
-        else:
-            suffix = img.suffix
-        if suffix == '.gif':
-            assert r.url.path.endswith('.gif')
-            if not url.endswith('.gif'):
-                assert r.url.path.endswith(
-                    ('/images/default_d_h_large.gif',
-                     '/images/default_d_w_large.gif',
-                     '/images/default_d_s_large.gif',
-                     '/images/default_w_large.gif',
-                     '/images/default_h_large.gif',
-                     '/images/default_s_large.gif',)), r.url.path
-                if i == 0:
-                    continue
-                elif i < 5:
-                    console.log(
-                        f"{url} shouldn't be gif, but redirected to {r.url} "
-                        f"(has tried {i} time(s))",
-                        style='error')
-                    continue
+                if ranged := (
+                        r.status_code == 200
+                        and length > RANGED_THRESHOLD
+                        and r.headers.get('Accept-Ranges') == 'bytes'):
+                    # fetched in ranges below, each taking its own slot
+                    validator = (r.headers.get('ETag')
+                                 or r.headers.get('Last-Modified'))
                 else:
-                    console.log(
-                        f'{img}: seems be deleted ({url})', style='error')
-            img = img.with_suffix('.gif')
-
-        elif img.suffix != suffix:
-            console.log(f"{img}: suffix should be {suffix}", style="warning")
-            img = img.with_suffix(suffix)
-
-        if int(r.headers['Content-Length']) != len(r.content):
-            console.log(f"expected length: {r.headers['Content-Length']}, "
-                        f"actual length: {len(r.content)} for {img}",
-                        style="error")
-            console.log(f'retrying download for {img}')
+                    try:
+                        size = await _write_part(
+                            part, first, chunks, length, offset)
+                    finally:
+                        progressed = part.exists() and (
+                            part.stat().st_size > offset)
+                    if size != length:
+                        console.log(f"expected length: {length}, "
+                                    f"actual length: {size} for {img}",
+                                    style="error")
+                        console.log(f'retrying download for {img}')
+                        metrics.inc('retries_total', client='download',
+                                    family=family, error='truncated')
+                        _drop_part(part, keep_resumable=size < length)
+                        continue
+                    part.replace(img)
+                    _drop_part(part)
+        except httpx.HTTPError as e:
+            metrics.inc('retries_total', client='download',
+                        family=family, error=type(e).__name__)
+            _drop_part(part, keep_resumable=True)
+            if i > 0:
+                console.log(f'download img {img} failed with {e!r} ({url})...'
+                            f' retry in {60 * (not progressed)} seconds...'
+                            f'(has tried {i} time(s))',
+                            style='error')
             continue
 
-        img.write_bytes(r.content)
+        if ranged:
+            size = await _download_ranges(url, part, length, validator)
+            if size != length:
+                console.log(
+                    f'{img}: only {naturalsize(size)} of '
+                    f'{naturalsize(length)} downloaded in ranges, retrying...',
+                    style='error')
+                _drop_part(part)
+                continue
+            part.replace(img)
+            _drop_part(part)
 
         if xmp_info:
-            write_xmp(img, xmp_info)
+            await metadata.write(img, xmp_info)
         console.log(f'successfully downloaded: {img}...', style="dim")
         return img
     else:
         raise ValueError(f'cannot download {url} for {img}')
 
 
-async def download_files(imgs: AsyncIterable[list[dict]]):
-    tasks = {}
+async def download_files(
+        imgs: AsyncIterable[list[dict]],
+        workers: int = DOWNLOAD_WORKERS,
+        resolve: Callable[[list[dict]], Awaitable[list[dict] | None]]
+        | None = None):
+    """
+    Download imgs by a fixed pool of workers.
+
+    The queue in between is bounded, so iterating imgs (and the fetching
+    behind it) waits while the downloads lag behind. Queued imgs with
+    signed urls go first, the sooner to expire the earlier.
+
+    Args:
+        resolve: return the fresh img for the img whose url expired,
+            None if it cannot be resolved. Expired imgs are skipped
+            without it, or when it returns None.
+
+    With client.journal, every img is recorded before queued, and the
+    imgs left unfinished by previous runs are downloaded alongside.
+    """
+    journal = client.journal
+    queue: asyncio.PriorityQueue[tuple] = asyncio.PriorityQueue(workers)
+    order = itertools.count()
+    failed_imgs, errors = [], []
+    done = busy = 0
+    # retries and re-resolvings waiting for their turn, holding no worker
+    retrying: set[asyncio.Task] = set()
+    # jobs started by this run, an attempt of the journal for each
+    started: set[int] = set()
+    # imgs taken by this run, so that an img resumed from the journal
+    # and given again by imgs is downloaded once
+    taken: set[str] = set()
+
+    async def put(item: tuple | None):
+        deadline = math.inf
+        if item:
+            expires = [_expires(media['url']) for media in item[1]]
+            deadline = min(filter(None, expires), default=math.inf)
+        await queue.put((deadline, next(order), item))
+
+    def reschedule(coro):
+        task = asyncio.create_task(coro)
+        retrying.add(task)
+        task.add_done_callback(retrying.discard)
+
+    def fail(job, img: list[dict], e: Exception):
+        if journal:
+            journal.fail(job, e)
+        for x in img:
+            x['filepath'] = str(x['filepath'])
+        failed_imgs.append(img)
+        errors.append(e)
+        console.log(f'EXCEPTION: {e!r} for {img}', style='error')
+
+    async def retry(item: tuple, delay: float):
+        await asyncio.sleep(delay)
+        await put(item)
+
+    async def refresh(item: tuple, e: MediaExpired):
+        job, img, resolved = item
+        console.log(f'{e}, resolving again...', style='warning')
+        try:
+            if resolved:
+                raise e
+            fresh = await resolve(img)
+        except Exception as err:
+            fail(job, img, err)
+            return
+        if fresh:
+            if journal:
+                journal.retry(job, fresh)
+            await put((job, fresh, True))
+            return
+        # skipped, as it is without resolve
+        console.log(f'cannot resolve {e.url}, skip...', style='warning')
+        if journal:
+            journal.done(job)
+
+    async def worker(n: int):
+        nonlocal done, busy
+        _queued.set(True)
+        while (item := (await queue.get())[-1]) is not None:
+            job, img, _ = item
+            busy += 1
+            if journal and job not in started:
+                started.add(job)
+                journal.start(job)
+            try:
+                await download_file_pair(img)
+            except RetryLater as e:
+                for media in img:
+                    if media['url'] == e.url:
+                        media['attempt'] = e.attempt
+                if journal:
+                    journal.retry(job, img)
+                reschedule(retry(item, e.delay))
+                continue
+            except MediaExpired as e:
+                if resolve:
+                    reschedule(refresh(item, e))
+                    continue
+                # skipped, as it is without download_files
+                console.log(str(e), style='warning')
+                if journal:
+                    journal.done(job)
+            except Exception as e:
+                console.log(f'worker {n} failed', style='error')
+                fail(job, img, e)
+            else:
+                if journal:
+                    journal.done(job)
+            finally:
+                busy -= 1
+                queue.task_done()
+            if (done := done + 1) % 50 == 0:
+                console.log(f'{done} imgs downloaded, {queue.qsize()} '
+                            f'queued, {len(retrying)} to retry, '
+                            f'{busy}/{workers} workers busy')
+
+    async def resume():
+        if leftovers := journal.leftovers():
+            console.log(f'resuming {len(leftovers)} downloads left by '
+                        'previous runs...', style='notice')
+        taken.update(journal.key(img) for _, img in leftovers)
+        for job, img in leftovers:
+            await put((job, img, False))
+
+    tasks = [asyncio.create_task(worker(n)) for n in range(workers)]
+    resuming = asyncio.create_task(resume()) if journal else None
     try:
         async for img in imgs:
-            task = asyncio.create_task(download_file_pair(img))
-            tasks[task] = img
-    except Exception:
-        raise
+            if (key := DownloadJournal.key(img)) in taken:
+                continue
+            taken.add(key)
+            await put((journal and journal.add(img), img, False))
     finally:
-        failed_imgs = []
-        errors = []
-        pending = list(tasks)
-        i = 0
-        while pending:
-            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-            for task in done:
-                task: asyncio.Future
-                i += 1
-                if i % 50 == 0:
-                    console.log(f'{i}/{len(tasks)} imgs downloaded')
-                if e := task.exception():
-                    failed_img = tasks[task]
-                    for x in failed_img:
-                        x['filepath'] = str(x['filepath'])
-                    failed_imgs.append(failed_img)
-                    errors.append(e)
-                    console.log(
-                        f'EXCEPTION: {e!r} for {failed_img}', style='error')
-
-        # for i, task in enumerate(asyncio.as_completed(tasks)):
-        #     if i % 50 == 0:
-        #         console.log(f'{i}/{len(tasks)} imgs downloaded')
-        #     try:
-        #         await task
-        #     except Exception as e:
-        #         failed_img = tasks[task]
-        #         failed_imgs.append(failed_img)
-        #         errors.append(e)
-        #         console.log(
-        #             f'EXCEPTION: {e!r} for {failed_img}', style='error')
-
-        console.log(f'{len(tasks)} imgs downloaded')
+        if resuming:
+            await resuming
+        while True:
+            await queue.join()
+            if not retrying:
+                break
+            await asyncio.wait(retrying)
+        for _ in tasks:
+            await put(None)
+        await asyncio.gather(*tasks)
+        console.log(f'{done} imgs downloaded')
         if failed_imgs:
             raise DownloadFilesFailed(failed_imgs, errors)
 
@@ -434,7 +1385,7 @@ async def normalize_user_id(user_id: str | int) -> int:
     except ValueError:
         assert isinstance(user_id, str)
         url = f'https://m.weibo.cn/n/{user_id}'
-        r = await fetcher.get(url, follow_redirects=True)
+        r = await fetcher.get(url, pool=True, follow_redirects=True)
         url_new = str(r.url)
         if url != unquote(url_new):
             user_id = int(url_new.split('/')[-1])
@@ -514,7 +1465,7 @@ async def parse_loc_src(loc_src: str) -> str:
     containerid = re.search(r'containerid=([\w-]+)', loc_src).group(1)
     api = ('https://m.weibo.cn/api/container/getIndex?'
            f'containerid={containerid}')
-    js = await fetcher.get_json(api)
+    js = await fetcher.get_json(api, pool=True)
     cards = js['data']['cards'][0]['card_group']
     params = cards[1]['scheme'].split('?')[-1].split('&')
     params = dict(p.split('=') for p in params)
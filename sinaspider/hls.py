@@ -0,0 +1,51 @@
+import re
+from urllib.parse import urljoin
+
+
+class Playlist:
+    """
+    Parsed m3u8 playlist.
+
+    A master playlist lists variants of the stream, a media playlist
+    lists the segments, with an init segment for fragmented mp4.
+    """
+
+    def __init__(self, text: str, url: str) -> None:
+        if not text.startswith('#EXTM3U'):
+            raise ValueError(f'{url} is not a m3u8 playlist')
+        self.url = url
+        # (bandwidth, url) of each variant
+        self.variants: list[tuple[int, str]] = []
+        self.segments: list[str] = []
+        self.init: str | None = None
+        self.encrypted = False
+        bandwidth = None
+        for line in text.splitlines():
+            if not (line := line.strip()):
+                continue
+            if line.startswith('#EXT-X-STREAM-INF:'):
+                match = re.search(r'[:,]BANDWIDTH=(\d+)', line)
+                bandwidth = int(match.group(1)) if match else 0
+            elif line.startswith('#EXT-X-MAP:'):
+                self.init = urljoin(url, _attr(line, 'URI'))
+            elif line.startswith('#EXT-X-KEY:'):
+                self.encrypted |= _attr(line, 'METHOD') != 'NONE'
+            elif line.startswith('#'):
+                continue
+            elif bandwidth is not None:
+                self.variants.append((bandwidth, urljoin(url, line)))
+                bandwidth = None
+            else:
+                self.segments.append(urljoin(url, line))
+
+    @property
+    def is_master(self) -> bool:
+        return bool(self.variants)
+
+    def best_variant(self) -> str:
+        return max(self.variants)[1]
+
+
+def _attr(line: str, name: str) -> str | None:
+    if match := re.search(rf'[:,]{name}=("[^"]*"|[^,]*)', line):
+        return match.group(1).strip('"')
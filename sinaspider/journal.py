@@ -0,0 +1,117 @@
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+
+class DownloadJournal:
+    """
+    Durable state of media downloads, in a sqlite file.
+
+    Every item given to download_files is recorded as queued, then
+    running, done or failed. Items left unfinished by a crashed or
+    stopped process are picked up by the next one.
+    """
+    MAX_ATTEMPTS = 3
+    KEEP_DONE = 30 * 24 * 3600  # seconds
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS job ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE, '
+            'medias TEXT, state TEXT, attempts INTEGER, error TEXT, '
+            'pid INTEGER, updated_at REAL)')
+        self._conn.execute(
+            'DELETE FROM job WHERE state = ? AND updated_at < ?',
+            ('done', time.time() - self.KEEP_DONE))
+        self._conn.commit()
+
+    def __str__(self) -> str:
+        counts = self._conn.execute(
+            'SELECT state, COUNT(*) FROM job GROUP BY state').fetchall()
+        counts = ', '.join(f'{n} {state}' for state, n in counts)
+        return f'{counts or "empty"} ({self.path})'
+
+    @staticmethod
+    def key(medias: list[dict]) -> str:
+        return str(Path(medias[0]['filepath']) / medias[0]['filename'])
+
+    def add(self, medias: list[dict]) -> int:
+        """
+        record medias as queued, return the job id
+        """
+        self._conn.execute(
+            'INSERT INTO job (key, medias, state, attempts, pid, updated_at) '
+            'VALUES (?, ?, ?, 0, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+            'medias = excluded.medias, state = excluded.state, '
+            'attempts = 0, error = NULL, pid = excluded.pid, '
+            'updated_at = excluded.updated_at',
+            (self.key(medias), json.dumps(medias, default=str),
+             'queued', os.getpid(), time.time()))
+        self._conn.commit()
+        return self._conn.execute(
+            'SELECT id FROM job WHERE key = ?',
+            (self.key(medias),)).fetchone()[0]
+
+    def start(self, job: int):
+        self._update(job, 'running', attempts=1)
+
+    def retry(self, job: int, medias: list[dict]):
+        """
+        keep the medias to retry, with the attempts they have made
+        """
+        self._conn.execute(
+            'UPDATE job SET medias = ?, updated_at = ? WHERE id = ?',
+            (json.dumps(medias, default=str), time.time(), job))
+        self._conn.commit()
+
+    def done(self, job: int):
+        self._update(job, 'done')
+
+    def fail(self, job: int, error: Exception):
+        self._update(job, 'failed', error=repr(error))
+
+    def _update(self, job: int, state: str,
+                attempts: int = 0, error: str | None = None):
+        self._conn.execute(
+            'UPDATE job SET state = ?, attempts = attempts + ?, error = ?, '
+            'updated_at = ? WHERE id = ?',
+            (state, attempts, error, time.time(), job))
+        self._conn.commit()
+
+    def leftovers(self) -> list[tuple[int, list[dict]]]:
+        """
+        Claim the unfinished jobs of the processes no longer running.
+
+        Jobs failed MAX_ATTEMPTS times are left as they are.
+        """
+        rows = self._conn.execute(
+            'SELECT id, medias, pid FROM job '
+            'WHERE state != ? AND attempts < ? ORDER BY id',
+            ('done', self.MAX_ATTEMPTS)).fetchall()
+        jobs = []
+        for job, medias, pid in rows:
+            if pid == os.getpid() or _is_alive(pid):
+                continue
+            self._conn.execute(
+                'UPDATE job SET pid = ? WHERE id = ?', (os.getpid(), job))
+            medias = json.loads(medias)
+            for media in medias:
+                media['filepath'] = Path(media['filepath'])
+            jobs.append((job, medias))
+        self._conn.commit()
+        return jobs
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
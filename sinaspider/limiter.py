@@ -0,0 +1,525 @@
+import asyncio
+import random
+import re
+import time
+from collections import deque
+from typing import AsyncIterator
+from urllib.parse import urlparse
+
+from sinaspider import console
+from sinaspider.metrics import metrics
+
+
+def endpoint_family(url: str) -> str:
+    """
+    Classify url into the endpoint family it shares rate budget with.
+
+    >> endpoint_family('https://api.weibo.cn/2/cardlist?containerid=...')
+        'api'
+    """
+    match urlparse(str(url)).hostname:
+        case 'api.weibo.cn':
+            return 'api'
+        case 'm.weibo.cn':
+            return 'm'
+        case 'weibo.cn':
+            return 'cn'
+        case 'place.weibo.com':
+            return 'place'
+        case str(host) if host.endswith('.sinaimg.cn'):
+            return 'media'
+        case _:
+            return 'other'
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float,
+                 tokens: float | None = None) -> None:
+        """
+        Args:
+            rate: tokens refilled per second
+            capacity: max tokens can be hold, i.e. the burst size
+            tokens: tokens at start, default to capacity
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity if tokens is None else tokens
+        self._updated = time.monotonic()
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Take tokens in advance, return seconds to wait before using them.
+
+        Tokens are allowed to go negative, so concurrent callers are
+        queued in the order they reserved.
+        """
+        self._refill()
+        self._tokens -= tokens
+        return max(0, -self._tokens / self.rate)
+
+    def refund(self, tokens: float = 1):
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def drain(self):
+        """
+        drop the saved tokens, so no burst follows
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """
+        Wait until tokens are available, return the seconds waited.
+        """
+        if wait := self.reserve(tokens):
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.refund(tokens)
+                raise
+        return wait
+
+
+class FairQueue:
+    """
+    Waiters of several lanes, served by weighted fair (stride) order.
+
+    A lane of weight 4 is served four times as often as a lane of
+    weight 1 while both have waiters. An idle lane gets no credit for
+    the time it was idle.
+    """
+
+    def __init__(self, weights: dict[str, float]) -> None:
+        self.weights = weights
+        self._waiters: dict[str, deque[asyncio.Future]] = {
+            lane: deque() for lane in weights}
+        self._pass = dict.fromkeys(weights, 0.0)
+        self._vtime = 0.0
+
+    def __bool__(self) -> bool:
+        return any(not f.done() for w in self._waiters.values() for f in w)
+
+    def put(self, lane: str) -> asyncio.Future:
+        if lane not in self.weights:
+            raise ValueError(f'unknown lane: {lane}')
+        if not self._waiters[lane]:
+            self._pass[lane] = max(self._pass[lane], self._vtime)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(future)
+        return future
+
+    def pop(self) -> asyncio.Future | None:
+        """
+        the next waiter to serve, None if no one is waiting
+        """
+        for waiters in self._waiters.values():
+            while waiters and waiters[0].done():
+                waiters.popleft()
+        lanes = [lane for lane, w in self._waiters.items() if w]
+        if not lanes:
+            return
+        lane = min(lanes, key=lambda x: (self._pass[x], -self.weights[x]))
+        self._vtime = self._pass[lane]
+        self._pass[lane] += 1 / self.weights[lane]
+        return self._waiters[lane].popleft()
+
+
+class Scheduler:
+    """
+    Token bucket per endpoint family.
+
+    Requests of different families never wait for each other, while
+    requests of the same family are paced to the family's rate.
+
+    Requests waiting on the same family are served by lane weights, so
+    interactive lookups overtake long running backfills, while the
+    family's rate is shared by all lanes.
+
+    If adaptive, the rate of a family is tuned by AIMD: it grows a bit
+    with each clean response and halves on each throttling signal.
+    """
+    # the former pause tiers (1s, and 16/64/256/1024/2048 seconds
+    # every 16/64/256/1024/2048 visits) averaged ~4.7s per request
+    RATE = 1 / 4.7
+    BURST = 16
+    RATES: dict[str, float] = {}
+    INCREASE = 0.002  # requests/second added per clean response
+    DECREASE = 0.5
+    MIN_RATE = 1 / 120
+    MAX_RATE = 1
+    LANES = {'interactive': 16, 'timeline': 4,
+             'refetch': 2, 'enrichment': 1}
+
+    def __init__(self, rate: float | None = None,
+                 burst: float | None = None,
+                 adaptive: bool = True) -> None:
+        self.rate = rate or self.RATE
+        self.burst = burst or self.BURST
+        self.adaptive = adaptive
+        self._buckets: dict[str, TokenBucket] = {}
+        self._queues: dict[str, FairQueue] = {}
+        self._dispatchers: dict[str, asyncio.Task] = {}
+
+    def bucket(self, family: str) -> TokenBucket:
+        if family not in self._buckets:
+            rate = self.RATES.get(family, self.rate)
+            self._buckets[family] = TokenBucket(rate, self.burst)
+        return self._buckets[family]
+
+    async def acquire(self, url: str, lane: str = 'timeline') -> float:
+        """
+        Wait for the turn of url in lane, return the seconds waited.
+        """
+        family = endpoint_family(url)
+        bucket = self.bucket(family)
+        queue = self._queues.setdefault(family, FairQueue(self.LANES))
+        if not queue and bucket.tokens >= 1:
+            bucket.reserve()
+            return 0
+        start = time.monotonic()
+        future = queue.put(lane)
+        if not (d := self._dispatchers.get(family)) or d.done():
+            self._dispatchers[family] = asyncio.create_task(
+                self._dispatch(family))
+        try:
+            await future
+        except asyncio.CancelledError:
+            console.log('Cancelled on sleep', style='error')
+            if future.done() and not future.cancelled():
+                bucket.refund()
+            raise
+        return time.monotonic() - start
+
+    async def _dispatch(self, family: str):
+        """
+        hand out the tokens of family to the waiters by lane
+        """
+        bucket, queue = self._buckets[family], self._queues[family]
+        while queue:
+            if (wait := bucket.reserve()) > 1:
+                console.log(
+                    f'sleep {wait:.1f} seconds...({family})', style='info')
+            await asyncio.sleep(wait)
+            # picked after sleep, so the waiters came in meanwhile
+            # still get their turn by lane
+            if future := queue.pop():
+                future.set_result(None)
+            else:
+                bucket.refund()
+
+    def success(self, url: str):
+        if not self.adaptive:
+            return
+        bucket = self.bucket(endpoint_family(url))
+        if bucket.rate < self.MAX_RATE:
+            bucket.rate = min(self.MAX_RATE, bucket.rate + self.INCREASE)
+
+    def throttled(self, url: str):
+        if not self.adaptive:
+            return
+        family = endpoint_family(url)
+        bucket = self.bucket(family)
+        bucket.rate = max(self.MIN_RATE, bucket.rate * self.DECREASE)
+        bucket.drain()
+        console.log(
+            f'throttled, slow down {family} to one request '
+            f'per {1 / bucket.rate:.1f} seconds', style='warning')
+
+    def state(self) -> dict[str, float]:
+        """
+        learned rate of each family
+        """
+        if not self.adaptive:
+            return {}
+        return {family: bucket.rate
+                for family, bucket in self._buckets.items()}
+
+    def restore(self, state: dict[str, float]):
+        """
+        continue with the learned rates, starting without burst
+        """
+        if not self.adaptive:
+            return
+        for family, rate in state.items():
+            rate = min(self.MAX_RATE, max(self.MIN_RATE, rate))
+            self._buckets[family] = TokenBucket(rate, self.burst, tokens=1)
+
+
+class HostLimiter:
+    """
+    Concurrent transfers per host, each limit tuned by AIMD.
+
+    After every window of `limit` transfers, a host's limit grows by one
+    if the window was clean and its throughput didn't drop, i.e. more
+    concurrency still pays off. It's cut by DECREASE on a failed
+    transfer, or on a response slower than LATENCY to arrive, at most
+    once per window.
+    """
+    LIMIT = 8
+    LIMITS: dict[str, int] = {}
+    MIN_LIMIT = 1
+    MAX_LIMIT = 48
+    DECREASE = 0.75
+    LATENCY = 10  # seconds to the response headers
+
+    def __init__(self) -> None:
+        self._hosts: dict[str, _Host] = {}
+
+    def __str__(self) -> str:
+        return ', '.join(f'{host}: {h.inflight}/{int(h.limit)}'
+                         for host, h in self._hosts.items()) or 'idle'
+
+    def host(self, url: str) -> '_Host':
+        host = urlparse(str(url)).hostname
+        if host not in self._hosts:
+            limit = self.LIMITS.get(host, self.LIMIT)
+            self._hosts[host] = _Host(host, limit)
+        return self._hosts[host]
+
+    async def acquire(self, url: str) -> float:
+        """
+        Wait for a free slot of the host of url, return the seconds waited.
+        """
+        h = self.host(url)
+        if h.inflight < h.limit and not h.waiters:
+            h.inflight += 1
+            h.gauge()
+            return 0
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        h.waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                h.inflight -= 1
+                self._wake(h)
+            raise
+        return time.monotonic() - start
+
+    def release(self, url: str, failed: bool = False,
+                latency: float = 0, size: int = 0):
+        """
+        Free the slot taken by acquire, with the outcome of the transfer.
+        """
+        h = self.host(url)
+        h.inflight -= 1
+        if failed or latency > self.LATENCY:
+            self._decrease(h, 'failed' if failed else f'{latency:.0f}s')
+        else:
+            h.window.append(size)
+            if len(h.window) >= h.limit:
+                self._window_done(h)
+        self._wake(h)
+
+    def _wake(self, h: '_Host'):
+        while h.waiters and h.inflight < h.limit:
+            if not (future := h.waiters.popleft()).done():
+                h.inflight += 1
+                future.set_result(None)
+        h.gauge()
+
+    def _window_done(self, h: '_Host'):
+        now = time.monotonic()
+        throughput = sum(h.window) / max(now - h.window_start, 1e-3)
+        if (h.limit < self.MAX_LIMIT and not h.decreased
+                and throughput >= h.throughput * 0.9):
+            h.limit += 1
+        h.throughput = throughput
+        h.reset(now)
+
+    def _decrease(self, h: '_Host', reason: str):
+        if h.decreased:
+            return
+        h.limit = max(self.MIN_LIMIT, h.limit * self.DECREASE)
+        h.decreased = True
+        console.log(f'{h.name}: transfer {reason}, limit concurrency to '
+                    f'{int(h.limit)}', style='warning')
+
+
+class _Host:
+    def __init__(self, name: str, limit: float) -> None:
+        self.name = name
+        self.limit = limit
+        self.inflight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        # bytes per transfer done in the current window, and the
+        # throughput of the last window
+        self.window: list[int] = []
+        self.throughput = 0.0
+        self.reset(time.monotonic())
+
+    def reset(self, now: float):
+        self.window = []
+        self.window_start = now
+        self.decreased = False
+
+    def gauge(self):
+        metrics.set('download_concurrency_limit', int(self.limit),
+                    host=self.name)
+        metrics.set('download_inflight', self.inflight, host=self.name)
+
+
+class BandwidthLimiter:
+    """
+    Token bucket on the bytes of media downloads, shared by all of them.
+
+    The rate may differ by time of day: each window is (start, end,
+    rate), start and end in minutes of the day, and the first window
+    covering now wins over the default rate. A rate of None is unlimited.
+
+    HEADROOM of every limited rate is left to the api traffic of Fetcher,
+    which is never shaped.
+    """
+    HEADROOM = 128 << 10  # bytes/second
+
+    def __init__(self, rate: float | None = None,
+                 windows: list[tuple[int, int, float | None]] = ()) -> None:
+        for r in [rate] + [w[2] for w in windows]:
+            if r is not None and r <= self.HEADROOM:
+                raise ValueError(
+                    f'bandwidth {r}B/s leaves nothing beyond the '
+                    f'headroom {self.HEADROOM}B/s for api requests')
+        self.rate = rate
+        self.windows = list(windows)
+        self._bucket = TokenBucket(1, 1)
+
+    def __str__(self) -> str:
+        if (rate := self.current_rate()) is None:
+            return 'unlimited'
+        return f'{rate / 2**20:.1f}MB/s for downloads'
+
+    @staticmethod
+    def parse(specs: list[str]) -> 'BandwidthLimiter':
+        """
+        Parse specs like ['2M', '0@00:00-07:00'], the rate in bytes per
+        second with suffix K/M/G, 0 for unlimited, and the optional
+        window it applies to.
+        """
+        rate, windows = None, []
+        for spec in specs:
+            value, _, window = spec.partition('@')
+            match = re.fullmatch(r'([\d.]+)([KMG]?)', value.upper())
+            if not match:
+                raise ValueError(f'invalid bandwidth: {spec}')
+            value = float(match.group(1)) * 1024 ** (
+                ' KMG'.index(match.group(2) or ' '))
+            value = value or None
+            if not window:
+                rate = value
+                continue
+            match = re.fullmatch(r'(\d+):(\d+)-(\d+):(\d+)', window)
+            if not match:
+                raise ValueError(f'invalid window: {spec}')
+            h1, m1, h2, m2 = map(int, match.groups())
+            windows.append((h1 * 60 + m1, h2 * 60 + m2, value))
+        return BandwidthLimiter(rate, windows)
+
+    def current_rate(self) -> float | None:
+        """
+        bytes/second left for downloads now, None if unlimited
+        """
+        now = time.localtime()
+        now = now.tm_hour * 60 + now.tm_min
+        rate = self.rate
+        for start, end, window_rate in self.windows:
+            if (start <= now < end if start <= end
+                    else now >= start or now < end):
+                rate = window_rate
+                break
+        return rate and rate - self.HEADROOM
+
+    async def shape(self, chunks: AsyncIterator[bytes],
+                    url: str) -> AsyncIterator[bytes]:
+        """
+        yield chunks no faster than the current rate
+        """
+        async for chunk in chunks:
+            if (rate := self.current_rate()) is not None:
+                if rate != self._bucket.rate:
+                    # the bucket holds a second of bytes at most
+                    self._bucket.rate = self._bucket.capacity = rate
+                    metrics.set('download_bandwidth_limit', rate)
+                if wait := await self._bucket.acquire(len(chunk)):
+                    metrics.observe('wait_seconds', wait, client='download',
+                                    family=endpoint_family(url),
+                                    reason='bandwidth')
+            yield chunk
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter.
+    """
+
+    def __init__(self, base: float = 2, cap: float = 300) -> None:
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int) -> float:
+        """
+        seconds to wait before retry, attempt starts from 0
+        """
+        delay = min(self.cap, self.base * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker:
+    """
+    Stop requests of one endpoint family after consecutive failures.
+
+    Once opened, requests of the family wait until the cooldown passed,
+    the cooldown doubles for each reopening until a request succeeds.
+    """
+    THRESHOLD = 3
+    COOLDOWN = 30
+    MAX_COOLDOWN = 600
+
+    def __init__(self, family: str) -> None:
+        self.family = family
+        self.failures = 0
+        self.cooldown = self.COOLDOWN
+        self._open_until = 0
+
+    @property
+    def is_open(self) -> bool:
+        return time.monotonic() < self._open_until
+
+    async def wait(self) -> float:
+        """
+        Wait until the circuit closed, return the seconds waited.
+        """
+        if (wait := self._open_until - time.monotonic()) <= 0:
+            return 0
+        console.log(
+            f'circuit of {self.family} is open, '
+            f'waiting {wait:.0f} seconds...', style='warning')
+        await asyncio.sleep(wait)
+        return wait
+
+    def success(self):
+        self.failures = 0
+        self.cooldown = self.COOLDOWN
+
+    def failure(self):
+        self.failures += 1
+        if self.failures < self.THRESHOLD or self.is_open:
+            return
+        self._open_until = time.monotonic() + self.cooldown
+        console.log(
+            f'{self.failures} failures in a row, open circuit of '
+            f'{self.family} for {self.cooldown} seconds', style='error')
+        self.cooldown = min(self.cooldown * 2, self.MAX_COOLDOWN)
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+import queue
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable
+
+from exiftool import ExifToolHelper
+from exiftool.exceptions import ExifToolExecuteError
+
+from sinaspider.postprocess import PostProcessor
+
+
+class MetadataWriter:
+    """
+    Write xmp tags by a small pool of stay-open exiftool processes.
+
+    Files queued within DELAY are written together, up to BATCH of them
+    by a single exiftool invocation reading their tags from a json file.
+    The file type is not checked again, the suffix of downloaded files is
+    already set by the detected mime type.
+
+    With sidecar on, tags go to the .xmp sidecar next to the file, which
+    leaves the media bytes untouched, and can be folded in later by
+    embed().
+    """
+    PROCESSES = 4
+    BATCH = 32
+    DELAY = 0.5  # seconds
+    PARAMS = ['-overwrite_original', '-ignoreMinorErrors', '-escapeHTML']
+    SIDECAR_PARAMS = ['-o', '%d%f.xmp', '-ignoreMinorErrors', '-escapeHTML']
+    EMBED_PARAMS = ['-tagsFromFile', '%d%f.xmp', '-xmp:all',
+                    '-overwrite_original', '-ignoreMinorErrors']
+
+    def __init__(self, postprocessor: PostProcessor,
+                 processes: int = PROCESSES, sidecar: bool = False) -> None:
+        self.postprocessor = postprocessor
+        self.processes = processes
+        self.sidecar = sidecar
+        self._idle: queue.SimpleQueue[ExifToolHelper] = queue.SimpleQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+        self._batch: list[tuple[Path, dict, asyncio.Future]] = []
+        self._flusher: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = self.files = 0
+
+    def __str__(self) -> str:
+        return (f'{self.files} files in {self.batches} batches '
+                f'by {self._started} exiftool processes'
+                + (' (sidecar)' if self.sidecar else ''))
+
+    @staticmethod
+    def sidecar_of(img: Path) -> Path:
+        return img.with_suffix('.xmp')
+
+    async def write(self, img: Path, tags: dict):
+        """
+        write tags to img, raise the error of exiftool if failed
+        """
+        # as set_tags gives them, one string per value
+        tags = {k: [str(x) for x in v] if isinstance(v, list) else str(v)
+                for k, v in tags.items()}
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((img, tags, future))
+        if len(self._batch) >= self.BATCH:
+            self._flush()
+        elif not self._flusher:
+            self._flusher = asyncio.create_task(self._flush_later())
+        await future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.DELAY)
+        self._flusher = None
+        self._flush()
+
+    def _flush(self):
+        if not (batch := self._batch):
+            return
+        self._batch = []
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[Path, dict, asyncio.Future]]):
+        try:
+            errors = await self.postprocessor.run(
+                'xmp', self._write_batch, [(img, tags)
+                                           for img, tags, _ in batch])
+        except Exception as e:
+            errors = [e] * len(batch)
+        self.batches += 1
+        self.files += len(batch)
+        for (*_, future), error in zip(batch, errors):
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(None)
+
+    async def embed(self, imgs: list[Path]) -> list[Exception | None]:
+        """
+        Fold the sidecars of imgs into them and remove the sidecars,
+        return the error of each img.
+        """
+        batches = [imgs[i:i + self.BATCH]
+                   for i in range(0, len(imgs), self.BATCH)]
+        errors = []
+        for batch, batch_errors in zip(batches, await asyncio.gather(*(
+                self.postprocessor.run('embed', self._embed_batch, batch)
+                for batch in batches))):
+            for img, error in zip(batch, batch_errors):
+                if not error:
+                    self.sidecar_of(img).unlink()
+            errors += batch_errors
+        return errors
+
+    def _write_batch(self, items: list[tuple[Path, dict]]
+                     ) -> list[Exception | None]:
+        return self._each(items, self._write)
+
+    def _embed_batch(self, imgs: list[Path]) -> list[Exception | None]:
+        return self._each(imgs, lambda et, imgs: et.execute(
+            *self.EMBED_PARAMS, *imgs))
+
+    def _write(self, et: ExifToolHelper, items: list[tuple[Path, dict]]):
+        if not self.sidecar:
+            _execute(et, items, self.PARAMS)
+            return
+        # exiftool creates new sidecars only by -o, which won't overwrite
+        if old := [(self.sidecar_of(img), tags) for img, tags in items
+                   if self.sidecar_of(img).exists()]:
+            _execute(et, old, self.PARAMS)
+        if new := [(img, tags) for img, tags in items
+                   if not self.sidecar_of(img).exists()]:
+            _execute(et, new, self.SIDECAR_PARAMS)
+
+    def _each(self, items: list, execute: Callable) -> list[Exception | None]:
+        """
+        Blocking, run execute on items by an exiftool process, return the
+        error of each item.
+
+        If the batch fails, items are run again one by one to tell which
+        of them failed.
+        """
+        et = self._take()
+        try:
+            try:
+                execute(et, items)
+                return [None] * len(items)
+            except ExifToolExecuteError as e:
+                if len(items) == 1:
+                    return [e]
+            errors = []
+            for item in items:
+                try:
+                    execute(et, [item])
+                except ExifToolExecuteError as e:
+                    errors.append(e)
+                else:
+                    errors.append(None)
+            return errors
+        finally:
+            self._idle.put(et)
+
+    def _take(self) -> ExifToolHelper:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._started < self.processes:
+                et = ExifToolHelper()
+                self._started += 1
+                return et
+        return self._idle.get()
+
+
+def _execute(et: ExifToolHelper, items: list[tuple[Path, dict]],
+             params: list[str]):
+    with tempfile.NamedTemporaryFile(
+            'w', suffix='.json', delete=False) as f:
+        json.dump([{'SourceFile': str(img), **tags} for img, tags in items],
+                  f, ensure_ascii=False, default=str)
+    try:
+        et.execute(f'-j={f.name}', *params, *(img for img, _ in items))
+    finally:
+        os.unlink(f.name)
@@ -0,0 +1,168 @@
+import json
+import math
+from collections import defaultdict
+
+# upper bounds of histogram buckets
+SECONDS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+BYTES = (1 << 10, 1 << 14, 1 << 17, 1 << 20, 1 << 23, 1 << 26, 1 << 29)
+DEPTH = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        estimated as the upper bound of the bucket holding quantile q
+        """
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            if (seen := seen + count) >= rank:
+                return bound
+        return math.inf
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        result, seen = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            result.append((bound, seen))
+        return result
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms keyed by name and labels.
+
+    Names follow prometheus conventions, e.g.
+    metrics.observe('request_seconds', 0.3, client='fetcher', family='api')
+    """
+    PREFIX = 'sinaspider_'
+
+    def __init__(self) -> None:
+        self.counters: dict[str, dict[tuple, float]] = defaultdict(
+            lambda: defaultdict(float))
+        self.histograms: dict[str, dict[tuple, Histogram]] = defaultdict(dict)
+        self.gauges: dict[str, dict[tuple, float]] = defaultdict(dict)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self.counters[name][tuple(sorted(labels.items()))] += value
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        if not (hist := self.histograms[name].get(key)):
+            if name.endswith('_bytes'):
+                buckets = BYTES
+            elif name.endswith('_depth'):
+                buckets = DEPTH
+            else:
+                buckets = SECONDS
+            hist = self.histograms[name][key] = Histogram(buckets)
+        hist.observe(value)
+
+    def snapshot(self) -> dict:
+        """
+        json-serializable dump of all metrics
+        """
+        snapshot = {}
+        for name, series in (self.counters | self.gauges).items():
+            snapshot[name] = [{'labels': dict(key), 'value': value}
+                              for key, value in series.items()]
+        for name, series in self.histograms.items():
+            snapshot[name] = [{
+                'labels': dict(key), 'count': h.count, 'sum': h.sum,
+                'buckets': {str(b): c for b, c in h.cumulative()},
+            } for key, h in series.items()]
+        return snapshot
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2, ensure_ascii=False)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for name, series in self.counters.items():
+            name = self.PREFIX + name
+            lines.append(f'# TYPE {name} counter')
+            for key, value in series.items():
+                lines.append(f'{name}{_labels(key)} {value:g}')
+        for name, series in self.gauges.items():
+            name = self.PREFIX + name
+            lines.append(f'# TYPE {name} gauge')
+            for key, value in series.items():
+                lines.append(f'{name}{_labels(key)} {value:g}')
+        for name, series in self.histograms.items():
+            name = self.PREFIX + name
+            lines.append(f'# TYPE {name} histogram')
+            for key, h in series.items():
+                for bound, count in h.cumulative():
+                    le = '+Inf' if bound == math.inf else f'{bound:g}'
+                    lines.append(
+                        f'{name}_bucket{_labels(key + (("le", le),))} '
+                        f'{count}')
+                lines.append(f'{name}_sum{_labels(key)} {h.sum:g}')
+                lines.append(f'{name}_count{_labels(key)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> list[str]:
+        """
+        one line per client and endpoint family, for the console
+        """
+        lines = []
+        wire = self.histograms.get('request_seconds', {})
+        for key, h in sorted(wire.items()):
+            labels = dict(key)
+            family = labels['family']
+            waits = ', '.join(
+                f'{dict(k)["reason"]} {w.sum:.0f}s'
+                for k, w in self.histograms.get('wait_seconds', {}).items()
+                if dict(k)['family'] == family
+                and dict(k)['client'] == labels['client'])
+            retries = {dict(k)['error']: int(v) for k, v in
+                       self.counters.get('retries_total', {}).items()
+                       if dict(k)['family'] == family
+                       and dict(k)['client'] == labels['client']}
+            size = self.histograms.get('response_bytes', {}).get(key)
+            lines.append(
+                f'{labels["client"]}/{family}: {h.count} requests, '
+                f'{h.sum:.0f}s on wire (p50 {h.quantile(0.5):g}s, '
+                f'p95 {h.quantile(0.95):g}s), '
+                f'{size.sum / 2**20 if size else 0:.1f}MB received; '
+                f'waited {waits or "0s"}; retries {retries or 0}')
+        for key, h in sorted(self.histograms.get('disk_seconds', {}).items()):
+            lines.append(f'disk/{dict(key)["op"]}: {h.count} times, '
+                         f'{h.sum:.1f}s (p95 {h.quantile(0.95):g}s)')
+        if depth := self.histograms.get('postprocess_depth', {}).get(()):
+            waits = self.histograms['postprocess_wait_seconds'].values()
+            lines.append(
+                f'postprocess: {depth.count} jobs, depth p95 '
+                f'{depth.quantile(0.95):g}, waited '
+                f'{sum(w.sum for w in waits):.1f}s for the pool')
+        return lines
+
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ''
+    # json string escaping is what prometheus expects for label values
+    labels = ','.join(f'{k}={json.dumps(str(v), ensure_ascii=False)}'
+                      for k, v in key)
+    return '{' + labels + '}'
+
+
+metrics = Metrics()
@@ -1,4 +1,5 @@
 
+import os
 from datetime import datetime
 from typing import Self
 
@@ -8,7 +9,9 @@ from playhouse.postgres_ext import DateTimeTZField as RawDateTimeTZField
 from playhouse.postgres_ext import PostgresqlExtDatabase
 from playhouse.shortcuts import model_to_dict
 
-database = PostgresqlExtDatabase("sinaspider", host="localhost")
+# point to a scratch database when crawling the stand-in server
+database = PostgresqlExtDatabase(
+    os.environ.get('SINASPIDER_DB', 'sinaspider'), host="localhost")
 
 
 class DateTimeTZField(RawDateTimeTZField):
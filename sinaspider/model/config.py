@@ -229,7 +229,7 @@ class UserConfig(BaseModel):
 
         now = pendulum.now()
         imgs = self._save_weibo(download_dir, refetch=refetch)
-        await download_files(imgs)
+        await download_files(imgs, resolve=Weibo.resolve_medias)
         console.log(f"{self.username}的微博🧣获取完毕\n")
         self.weibo_fetch_at = now
         self.weibo_next_fetch = self.get_weibo_next_fetch()
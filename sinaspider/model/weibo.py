@@ -1,4 +1,3 @@
-import asyncio
 import itertools
 import json
 import re
@@ -291,6 +290,24 @@ class Weibo(BaseModel):
                 "filepath": filepath,
             }]
 
+    @classmethod
+    async def resolve_medias(cls, medias: list[dict]) -> list[dict] | None:
+        """
+        Refetch the weibo of medias, return them with fresh urls.
+
+        Liked medias are named after the liker, so never resolved here.
+        """
+        xmp_info = medias[0]['xmp_info']
+        if xmp_info.get('XMP:ImageSupplierName') == 'WeiboLiked':
+            return
+        bid = xmp_info['XMP:ImageUniqueID']
+        weibo = await cls.from_id(bid, update=True)
+        fresh = weibo.medias(medias[0]['filepath'],
+                             extra=bool(weibo.photos_extra))
+        for media in fresh:
+            if media[0]['filename'] == medias[0]['filename']:
+                return media
+
     def gen_meta(self, sn: str | int = '', url: str = "") -> dict:
         if photos := ((self.photos or [])+(self.photos_edited or [])
                       + (self.videos or [])):
@@ -410,7 +427,8 @@ class Location(BaseModel):
             if info := (await cls.get_location_info_v2(location_id)
                         or await cls.get_location_info_v1p5(location_id)
                         or cls.get_location_info_from_database(location_id)):
-                cls.insert(info).execute()
+                # may be inserted by other task while fetching
+                cls.insert(info).on_conflict_ignore().execute()
             else:
                 return
         return cls.get_by_id(location_id)
@@ -437,7 +455,7 @@ class Location(BaseModel):
     @staticmethod
     async def get_location_info_v2(location_id):
         api = f'http://place.weibo.com/wandermap/pois?poiid={location_id}'
-        info = await fetcher.get_json(api, art_login=True)
+        info = await fetcher.get_json(api, pool=True, lane='enrichment')
         if not info:
             return
         assert info.pop('poiid') == location_id
@@ -465,7 +483,7 @@ class Location(BaseModel):
                  f'containerid=2306570042{location_id}')
         api = ('https://api.weibo.cn/2/cardlist?&from=10DA093010'
                f'&c=iphone&s=ba74941a&containerid=2306570042{location_id}')
-        js = await fetcher.get_json(api, art_login=True)
+        js = await fetcher.get_json(api, art_login=True, lane='enrichment')
         cards = js['cards'][0]['card_group']
         pic = cards[0]['pic']
         if 'android_delete_poi.png' in pic:
@@ -701,20 +719,12 @@ async def get_mblog_from_weico(id):
 
 async def get_mblog_from_web(weibo_id: str | int) -> dict:
     url = f'https://m.weibo.cn/detail/{weibo_id}'
-    while True:
-        text = (await fetcher.get(url)).text
-        soup = BeautifulSoup(text, 'html.parser')
-        if soup.title.text == '微博-出错了':
-            assert (err_msg := soup.body.p.text.strip())
-            if err_msg in ['请求超时', 'Redis执行失败']:
-                console.log(
-                    f'{err_msg} for {url}, sleeping 60 secs...',
-                    style='error')
-                await asyncio.sleep(60)
-                continue
-            else:
-                raise WeiboNotFoundError(err_msg, url)
-        break
+    # transient errors such as 请求超时 are retried by fetcher
+    text = (await fetcher.get(url, pool=True)).text
+    soup = BeautifulSoup(text, 'html.parser')
+    if soup.title.text == '微博-出错了':
+        assert (err_msg := soup.body.p.text.strip())
+        raise WeiboNotFoundError(err_msg, url)
     rec = re.compile(
         r'.*var \$render_data = \[(.*)]\[0] \|\| \{};', re.DOTALL)
     html = rec.match(text).groups(1)[0]
@@ -13,6 +13,8 @@ from sinaspider.helper import fetcher
 
 
 class SinaBot:
+    _fetch_locks: dict[int, asyncio.Lock] = {}
+
     @classmethod
     async def create(cls, art_login: bool = True) -> Self:
         bot = cls(art_login)
@@ -38,6 +40,7 @@ class SinaBot:
         js = response.json()
         if js.get('errormsg'):
             raise ValueError(js)
+        fetcher.invalidate(str(uid))
 
     async def set_special_follow(self, uid, special_follow: bool):
         s = "4fff7801"  # for art_login
@@ -52,6 +55,7 @@ class SinaBot:
                 'adding to special following failed', style='error')
             return
         assert js['result'] is True
+        fetcher.invalidate(str(uid))
         # url = ('https://m.weibo.cn/api/container/getIndex?'
         #        f'containerid=100505{uid}')
         # js = fetcher.get(url, art_login=self.art_login).json()
@@ -74,6 +78,7 @@ class SinaBot:
             return
         elif errmsg:
             raise ValueError(js)
+        fetcher.invalidate(str(uid))
         url = ('https://m.weibo.cn/api/container/getIndex?'
                f'containerid=100505{uid}')
         js = await fetcher.get_json(url, art_login=self.art_login)
@@ -93,6 +98,7 @@ class SinaBot:
         response = fetcher.post(url,  data=data, art_login=self.art_login)
         response.raise_for_status()
         js = response.json()
+        fetcher.invalidate(str(uid))
         if js.get('errmsg') == 'not followed':
             console.log(f'{uid} alread unfollowed', )
         else:
@@ -170,23 +176,27 @@ class SinaBot:
         async for status in Page.timeline(
                 since=since, friend_circle=friend_circle):
             uid = status['user']['id']
-            if not (config := UserConfig.get_or_none(user_id=uid)):
-                continue
-            config: UserConfig
-            if not (config.weibo_fetch and config.weibo_fetch_at):
-                continue
-            created_at = pendulum.from_format(
-                status['created_at'], 'ddd MMM DD HH:mm:ss ZZ YYYY')
-            if created_at <= config.weibo_fetch_at:
-                assert Weibo.get_or_none(id=status['id'])
-                continue
-            for _ in range(3):
-                config = await UserConfig.from_id(uid)
-                if config.following == self.art_login:
-                    await config.fetch_weibo(download_dir)
-                    break
-            else:
-                raise ValueError(f'{config.username} not following')
+            # the timeline of the other account may be fetching the same user
+            async with self._fetch_locks.setdefault(uid, asyncio.Lock()):
+                if not (config := UserConfig.get_or_none(user_id=uid)):
+                    continue
+                config: UserConfig
+                if not (config.weibo_fetch and config.weibo_fetch_at):
+                    continue
+                created_at = pendulum.from_format(
+                    status['created_at'], 'ddd MMM DD HH:mm:ss ZZ YYYY')
+                if created_at <= config.weibo_fetch_at:
+                    assert Weibo.get_or_none(id=status['id'])
+                    continue
+                for _ in range(3):
+                    config = await UserConfig.from_id(uid)
+                    if config.following == self.art_login:
+                        await config.fetch_weibo(download_dir)
+                        break
+                    # following state may be stale in cache
+                    fetcher.invalidate(str(uid))
+                else:
+                    raise ValueError(f'{config.username} not following')
             if config.liked_next_fetch:
                 console.log(
                     f'latest liked fetch at {config.liked_fetch_at:%y-%m-%d}, '
@@ -208,13 +218,17 @@ class Page:
                 start_page: the start page to fetch
                 parse: whether to parse weibo, default True
         """
-        url = ('https://m.weibo.cn/api/container/getIndex?containerid='
-               f'230413{self.id}_-_WEIBO_SECOND_PROFILE_ORI')
+        url = 'https://m.weibo.cn/api/container/getIndex'
         since_id = None
         ids = []
         for page in itertools.count(start=1):
-            params = {'since_id': since_id} if since_id else None
-            data = (await fetcher.get_json(url, params=params))['data']
+            # params replaces the query of url since httpx 0.28
+            params = {'containerid':
+                      f'230413{self.id}_-_WEIBO_SECOND_PROFILE_ORI'}
+            if since_id:
+                params['since_id'] = since_id
+            data = (await fetcher.get_json(
+                url, params=params, pool=True))['data']
             created_at = None
 
             for weibo_info in _yield_from_cards(data['cards']):
@@ -364,25 +378,14 @@ class Page:
                f'230869{self.id}-_mix-_like-pic&page=%s&s={s}')
         for page in itertools.count(start=1):
             console.log(f'Fetching liked weibo page {page}...')
-            while True:
-                if (r := await fetcher.get(url % page)).status_code != 200:
-                    console.log(
-                        f'{r.url} get status code {r.status_code}...',
-                        style='warning')
-                elif 'cards' in (js := r.json()):
-                    break
-                elif js.get('errmsg') == 'attitude: user status wrong':
-                    raise UserNotFoundError(
-                        f'attitude: user {self.id} status wrong')
-                else:
-                    console.log(f'{r.url} get js error: {js}', style='error')
-                console.log('sleeping 60 seconds')
-                await asyncio.sleep(60)
-
+            js = await fetcher.get_json(url % page, check=_check_liked)
+            if js.get('errmsg') == 'attitude: user status wrong':
+                raise UserNotFoundError(
+                    f'attitude: user {self.id} status wrong')
             if (cards := js['cards']) is None:
                 console.log(
-                    f"js[cards] is None for [link={r.url}]r.url[/link]",
-                    style='warning')
+                    f"js[cards] is None for [link={url % page}]"
+                    f"{url % page}[/link]", style='warning')
                 break
             for mblog in _yield_from_cards(cards):
                 yield mblog
@@ -494,6 +497,13 @@ class Page:
             return False
 
 
+def _check_liked(r) -> str | None:
+    js = r.json()
+    if 'cards' in js or js.get('errmsg') == 'attitude: user status wrong':
+        return
+    return f'js error: {js}'
+
+
 def _yield_from_cards(cards):
     for card in cards:
         if card['card_type'] == 9:
@@ -1,5 +1,6 @@
 import asyncio
 import html
+import itertools
 import re
 import warnings
 
@@ -17,14 +18,17 @@ class UserParser:
         self._user = None
 
     async def parse(self) -> dict:
-        while True:
+        for attempt in itertools.count():
             try:
                 return await self._parse()
             except (AssertionError, KeyError):
+                period = fetcher.backoff.delay(attempt)
                 console.log(
-                    f'AssertionError, retrying parse user {self.id}',
-                    style='error')
-                await asyncio.sleep(60)
+                    f'AssertionError, retrying parse user {self.id} '
+                    f'in {period:.0f} seconds', style='error')
+                # the cached responses may be inconsistent, refetch them
+                fetcher.invalidate(str(self.id))
+                await asyncio.sleep(period)
 
     async def _parse(self) -> dict:
         if self._user is not None:
@@ -167,10 +171,7 @@ class UserParser:
         """获取主信息."""
         url = ('https://m.weibo.cn/api/container/getIndex?'
                f'containerid=100505{self.id}')
-        while not (js := await fetcher.get_json(url, art_login=True))['ok']:
-            console.log(
-                f'not js[ok] for {url}, sleeping 60 secs...', style='warning')
-            await asyncio.sleep(60)
+        js = await fetcher.get_json(url, art_login=True, check=_check_ok)
         user_info = js['data']['userInfo']
         keys = ['cover_image_phone', 'profile_image_url',
                 'profile_url', 'toolbar_menus', 'badge']
@@ -203,3 +204,8 @@ class UserParser:
         cards = cards[0]['card_group']
         uids = [card['user']['id'] for card in cards]
         return uids
+
+
+def _check_ok(r) -> str | None:
+    if not r.json()['ok']:
+        return 'not js[ok]'
@@ -0,0 +1,65 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from sinaspider.metrics import metrics
+
+
+class PostProcessor:
+    """
+    Thread pool for the blocking work on downloaded media, e.g. exiftool
+    round-trips and fixing live photos, off the event loop.
+
+    At most depth jobs are handed to the pool, callers beyond that wait
+    in run(), so finished downloads don't pile up unprocessed.
+    """
+    WORKERS = 4
+    DEPTH = 16
+
+    def __init__(self, workers: int = WORKERS, depth: int = DEPTH) -> None:
+        self.pool = ThreadPoolExecutor(
+            workers, thread_name_prefix='postprocess')
+        self.depth = depth
+        self._slots = asyncio.Semaphore(depth)
+        # jobs waiting for a slot, and jobs handed to the pool
+        self.pending = self.inflight = 0
+
+    def __str__(self) -> str:
+        return (f'{self.inflight}/{self.depth} in pool, '
+                f'{self.pending} waiting')
+
+    async def run(self, op: str, func: Callable, *args):
+        """
+        run func(*args) in the pool, return its result
+        """
+        start = time.monotonic()
+        self.pending += 1
+        self._gauge()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.pending -= 1
+        metrics.observe('postprocess_wait_seconds',
+                        time.monotonic() - start, op=op)
+        metrics.observe('postprocess_depth', self.inflight + 1)
+        self.inflight += 1
+        self._gauge()
+        try:
+            result, elapsed = await asyncio.get_running_loop(
+            ).run_in_executor(self.pool, _timed, func, args)
+        finally:
+            self.inflight -= 1
+            self._gauge()
+            self._slots.release()
+        metrics.observe('disk_seconds', elapsed, op=op)
+        return result
+
+    def _gauge(self):
+        metrics.set('postprocess_pending', self.pending)
+        metrics.set('postprocess_inflight', self.inflight)
+
+
+def _timed(func: Callable, args: tuple) -> tuple:
+    start = time.monotonic()
+    return func(*args), time.monotonic() - start
@@ -1,8 +1,94 @@
+import asyncio
+import os
+from pathlib import Path
 
-from typer import Typer
+from typer import BadParameter, Option, Typer
 
-from . import database, liked, timeline, user
+from sinaspider import console
+from sinaspider.cassette import Cassette
+from sinaspider.helper import client, fetcher, metadata
+from sinaspider.limiter import BandwidthLimiter, Scheduler
+from sinaspider.model import database as db
+
+from . import database, liked, standin, timeline, user
+from .helper import open_stores
 
 app = Typer()
-for app_ in [user.app, liked.app, database.app, timeline.app]:
+for app_ in [user.app, liked.app, database.app, timeline.app,
+             standin.app]:
     app.registered_commands += app_.registered_commands
+
+
+@app.callback()
+def main(http2: bool = Option(
+        False, help='use HTTP/2 for api.weibo.cn and sinaimg hosts'),
+        no_cache: bool = Option(
+            False, help='bypass the on-disk response cache'),
+        record: Path = Option(
+            None, help='record all http traffic into the cassette'),
+        replay: Path = Option(
+            None, help='serve http traffic from the cassette, offline'),
+        replay_latency: float = Option(
+            None, help='seconds per replayed response, '
+            'default to the recorded one'),
+        standin: str = Option(
+            None, help='url of the stand-in server to crawl instead'),
+        xmp_sidecar: bool = Option(
+            False, help='write metadata to .xmp sidecars, '
+            'embed them later by embed-sidecars'),
+        bandwidth: list[str] = Option(
+            None, help='cap media downloads in bytes/second, e.g. 2M, '
+            'or 0@00:00-07:00 for a time window, 0 for unlimited')):
+    if record and replay:
+        raise BadParameter('--record and --replay are exclusive')
+    if standin:
+        # keep the stand-in data away from the real ones
+        if db.database == 'sinaspider':
+            raise BadParameter(
+                'set SINASPIDER_DB to a scratch database for the stand-in')
+        if not os.environ.get('SINASPIDER_DIR'):
+            raise BadParameter(
+                'set SINASPIDER_DIR to a scratch directory for the stand-in')
+    open_stores()
+    # for rebuilding the clients
+    options = {}
+    if standin:
+        console.log(f'crawling the stand-in at {standin}', style='notice')
+        fetcher.cache = None
+        client.journal = client.dead_urls = None
+        options['standin'] = standin
+    if no_cache:
+        fetcher.cache = None
+    if xmp_sidecar:
+        metadata.sidecar = True
+    if bandwidth:
+        try:
+            client.bandwidth = BandwidthLimiter.parse(bandwidth)
+        except ValueError as e:
+            raise BadParameter(str(e))
+        console.log(f'bandwidth: {client.bandwidth}', style='notice')
+    if record or replay:
+        mode = 'record' if record else 'replay'
+        cassette = Cassette(record or replay, mode, replay_latency)
+        console.log(f'cassette: {mode} {cassette.path}', style='notice')
+        # cache hits differ between runs, keep them out of the cassette
+        fetcher.cache = None
+        client.journal = client.dead_urls = None
+        options['cassette'] = cassette
+    if options or http2:
+        asyncio.run(configure(http2, **options))
+    if replay or standin:
+        # nothing to be polite to, go without pacing
+        for account in fetcher.accounts.values():
+            account.scheduler = Scheduler(
+                rate=1e6, burst=1e6, adaptive=False)
+
+
+async def configure(http2: bool, **options):
+    """
+    rebuild the clients of fetcher and client with options
+    """
+    await fetcher.configure(
+        http2_hosts=['api.weibo.cn'] if http2 else None, **options)
+    await client.configure(
+        http2_hosts=['*.sinaimg.cn'] if http2 else None, **options)
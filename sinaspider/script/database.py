@@ -1,4 +1,5 @@
 import asyncio
+import glob
 import itertools
 import json
 from pathlib import Path
@@ -12,7 +13,7 @@ from sinaspider.helper import (
     download_file_pair,
     download_files,
     download_single_file,
-    encode_wb_id, fetcher
+    encode_wb_id, fetcher, metadata
 )
 from sinaspider.model import User, UserConfig, Weibo
 from sinaspider.page import SinaBot
@@ -80,7 +81,37 @@ async def from_json(filepath: Path):
             for x in img:
                 x['filepath'] = Path(x['filepath'])
             yield img
-    await download_files(get_imgs())
+    await download_files(get_imgs(), resolve=Weibo.resolve_medias)
+
+
+@app.command(help="download what previous runs left unfinished")
+@logsaver_decorator
+@run_async
+async def resume_downloads():
+    async def no_imgs():
+        return
+        yield
+    await download_files(no_imgs(), resolve=Weibo.resolve_medias)
+
+
+@app.command(help="embed the xmp sidecars into their media files")
+@logsaver_decorator
+@run_async
+async def embed_sidecars(download_dir: Path = default_path):
+    imgs = []
+    for sidecar in download_dir.rglob('*.xmp'):
+        for img in sidecar.parent.glob(f'{glob.escape(sidecar.stem)}.*'):
+            if img.stem == sidecar.stem and img != sidecar:
+                imgs.append(img)
+                break
+        else:
+            console.log(f'no media for {sidecar}', style='warning')
+    console.log(f'embedding {len(imgs)} sidecars...')
+    errors = await metadata.embed(imgs)
+    for img, error in zip(imgs, errors):
+        if error:
+            console.log(f'failed to embed {img}: {error!r}', style='error')
+    console.log(f'{errors.count(None)} sidecars embedded')
 
 
 @app.command(help="fetch weibo by weibo_id")
@@ -88,6 +119,7 @@ async def from_json(filepath: Path):
 @run_async
 async def weibo(download_dir: Path = default_path, no_watermark: bool = False):
     from photosinfo.model import PhotoExif
+    fetcher.set_lane('interactive')
     while weibo_id := Prompt.ask('请输入微博ID:smile:'):
         await fetcher.toggle_art(True)
         try:
@@ -121,6 +153,7 @@ async def update_missing(update: bool = False):
 
     from .helper import LogSaver
     logsaver = LogSaver('update_missing', default_path)
+    fetcher.set_lane('refetch')
     WeiboMissed.add_missing()
     WeiboMissed.add_missing_from_weiboliked()
     while update:
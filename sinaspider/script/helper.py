@@ -1,5 +1,6 @@
 import asyncio
 import json
+import os
 import sys
 import time
 from functools import wraps
@@ -10,17 +11,37 @@ import pendulum
 from rich.terminal_theme import MONOKAI
 
 from sinaspider import console
+from sinaspider.cache import DeadUrls, ResponseCache
 from sinaspider.exceptions import DownloadFilesFailed
-from sinaspider.helper import fetcher
+from sinaspider.helper import client, fetcher, metadata
+from sinaspider.journal import DownloadJournal
+from sinaspider.metrics import metrics
 from sinaspider.model import PG_BACK
 
-if not (d := Path('/Volumes/Art')).exists():
-    d = Path.home()/'Pictures'
-default_path = d / 'Sinaspider'
+if d := os.environ.get('SINASPIDER_DIR'):
+    # a scratch directory, e.g. for crawling the stand-in
+    default_path = Path(d)
+    default_path.mkdir(parents=True, exist_ok=True)
+else:
+    if not (d := Path('/Volumes/Art')).exists():
+        d = Path.home()/'Pictures'
+    default_path = d / 'Sinaspider'
 
 pg_back = PG_BACK(default_path/'.pg_backup')
 
 
+def open_stores():
+    """
+    open the response cache, the learned rates, the download journal and
+    the dead urls kept in default_path
+    """
+    cache_path = default_path / '.cache'
+    fetcher.cache = ResponseCache(cache_path / 'responses.sqlite')
+    fetcher.load_rates(cache_path / 'rates.json')
+    client.journal = DownloadJournal(cache_path / 'downloads.sqlite')
+    client.dead_urls = DeadUrls(cache_path / 'dead_urls.sqlite')
+
+
 def print_command():
     argv = sys.argv
     argv[0] = Path(argv[0]).name
@@ -37,6 +58,12 @@ def logsaver_decorator(func):
             try:
                 return func(*args, **kwargs)
             except DownloadFilesFailed as e:
+                if client.journal:
+                    # retried by the next run
+                    console.log(
+                        f'failed imgs are kept in download journal: '
+                        f'{client.journal}', style='error')
+                    raise e.errs[0]
                 filename = f'failed_imgs_{pendulum.now().strftime("%Y%m%d%H%M%S")}.json'
                 json_file = default_path / filename
                 console.log(
@@ -71,7 +98,12 @@ def save_log(func_name, download_dir: Path):
     console.log(f'Saving log to {log_path}')
 
     console.save_html(log_path, theme=MONOKAI)
-    fetcher.save_cookie()
+    log_path.with_suffix('.prom').write_text(metrics.to_prometheus())
+    log_path.with_suffix('.json').write_text(metrics.to_json())
+    if not fetcher.standin:
+        # cookies of the stand-in are not real ones
+        fetcher.save_cookie()
+    fetcher.save_rates()
 
 
 class LogSaver:
@@ -94,6 +126,24 @@ class LogSaver:
             f'threshold: {self.SAVE_LOG_FOR_COUNT}')
         console.log(
             f'log hours: {log_hours}, threshold: {self.SAVE_LOG_INTERVAL}h')
+        console.log(f'fetcher connections: {fetcher.conn_stats}')
+        console.log(f'requests collapsed into in-flight ones: '
+                    f'{fetcher.collapsed}')
+        if fetcher.cache:
+            console.log(f'response cache: {fetcher.cache}')
+        console.log(f'download connections: {client.conn_stats}')
+        console.log(f'download concurrency: {client.limiter}')
+        console.log(f'download bandwidth: {client.bandwidth}')
+        if client.journal:
+            console.log(f'download journal: {client.journal}')
+        if client.dead_urls:
+            console.log(f'dead urls: {client.dead_urls}')
+        if fetcher.cassette:
+            console.log(f'cassette: {fetcher.cassette}')
+        if metadata.files:
+            console.log(f'metadata written: {metadata}')
+        for line in metrics.summary():
+            console.log(line)
         if (log_hours > self.SAVE_LOG_INTERVAL or
                 fetch_count > self.SAVE_LOG_FOR_COUNT):
             console.log('Threshold reached, saving log automatically...')
@@ -7,6 +7,7 @@ from typer import Option, Typer
 
 from sinaspider import console
 from sinaspider.exceptions import UserNotFoundError
+from sinaspider.helper import fetcher
 from sinaspider.model import UserConfig
 
 from .helper import default_path, logsaver_decorator, run_async
@@ -18,6 +19,7 @@ app = Typer()
 @logsaver_decorator
 @run_async
 async def liked(download_dir: Path = default_path):
+    fetcher.set_lane('interactive')
     while user_id := Prompt.ask('请输入用户名:smile:'):
         query = (UserConfig.select()
                  .order_by(UserConfig.liked_fetch_at.asc(nulls='first')))
@@ -0,0 +1,39 @@
+import time
+
+from typer import Option, Typer
+
+from sinaspider import console
+from sinaspider.standin import StandinServer, World
+
+app = Typer()
+
+
+@app.command(help='Serve synthetic weibo endpoints for load testing')
+def standin(port: int = 8765,
+            users: int = 20,
+            weibos: int = 100,
+            friends: int = 5,
+            edit_rate: float = 0.1,
+            live_rate: float = 0.3,
+            location_rate: float = 0.2,
+            error_rate: float = Option(
+                0, help='ratio of api requests answered with an error'),
+            media_size: int = 256 * 1024,
+            seed: int = 0,
+            interval: float = Option(60, help='seconds between stats')):
+    world = World(users, weibos, friends, edit_rate, live_rate,
+                  location_rate, media_size, seed)
+    server = StandinServer(world, port, error_rate)
+    server.start()
+    console.log(f'stand-in of {len(world.uids)} users with {weibos} weibos '
+                f'each is serving at {server.url}', style='notice')
+    console.log('crawl it with: SINASPIDER_DB=<scratch database> '
+                'SINASPIDER_DIR=<scratch directory> '
+                f'sinaspider --standin {server.url} <command>')
+    try:
+        while True:
+            time.sleep(interval)
+            console.log(f'stand-in: {server}')
+    except KeyboardInterrupt:
+        server.shutdown()
+        console.log(f'stand-in: {server}')
@@ -1,3 +1,4 @@
+import asyncio
 import select
 import sys
 from pathlib import Path
@@ -50,10 +51,11 @@ async def timeline(days: float = Option(...),
         start_time = pendulum.now()
         console.log(f'Fetching timeline since {since}...')
 
-        await bot_art.get_timeline(download_dir=download_dir, since=since,
-                                   friend_circle=False)
-        await bot.get_timeline(download_dir=download_dir,
-                               since=since, friend_circle=True)
+        await asyncio.gather(
+            bot_art.get_timeline(download_dir=download_dir, since=since,
+                                 friend_circle=False),
+            bot.get_timeline(download_dir=download_dir,
+                             since=since, friend_circle=True))
         since = start_time
 
         if start_time.diff().in_minutes() < WORKING_TIME:
@@ -22,6 +22,7 @@ app = Typer()
 @run_async
 async def user(download_dir: Path = default_path):
     """Add user to database of users whom we want to fetch from"""
+    fetcher.set_lane('interactive')
     while user_id := Prompt.ask('请输入用户名:smile:').strip():
         if config := UserConfig.get_or_none(username=user_id):
             user_id = config.user_id
@@ -0,0 +1,687 @@
+import base64
+import json
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import pendulum
+
+from sinaspider import console
+from sinaspider.limiter import endpoint_family
+
+# 1x1 baseline jpeg, padded with comment segments to the media size
+_JPEG = base64.b64decode(
+    '/9j/4AAQSkZJRgABAQEASABIAAD/2wBDAP//////////////////////////////////'
+    '////////////////////////////////////////////////////wgALCAABAAEBAREA'
+    '/8QAFBABAAAAAAAAAAAAAAAAAAAAAP/aAAgBAQABPxA=') + b'\xff\xd9'
+
+LOCATIONS = [
+    ('上海·外滩', 31.2400, 121.4900),
+    ('北京·三里屯', 39.9370, 116.4550),
+    ('杭州·西湖', 30.2590, 120.1300),
+    ('成都·太古里', 30.6540, 104.0830),
+    ('广州·珠江新城', 23.1200, 113.3240),
+]
+
+
+def fake_jpeg(size: int) -> bytes:
+    padding = []
+    remain = max(0, size - len(_JPEG))
+    while remain > 4:
+        n = min(remain - 4, 65533)
+        padding.append(b'\xff\xfe' + struct.pack('>H', n + 2) + bytes(n))
+        remain -= n + 4
+    return _JPEG[:2] + b''.join(padding) + _JPEG[2:]
+
+
+def fake_mov(size: int) -> bytes:
+    mvhd = (b'mvhd' + bytes(4)
+            + struct.pack('>IIIIIH', 0, 0, 1000, 0, 0x10000, 0x100)
+            + bytes(10) + struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000,
+                                      0, 0, 0, 0x40000000)
+            + bytes(24) + struct.pack('>I', 1))
+    mvhd = struct.pack('>I', len(mvhd) + 4) + mvhd
+    moov = struct.pack('>I', len(mvhd) + 8) + b'moov' + mvhd
+    ftyp = struct.pack('>I', 20) + b'ftypqt  ' + bytes(4) + b'qt  '
+    mdat = bytes(max(0, size - len(ftyp) - len(moov) - 8))
+    return ftyp + moov + struct.pack('>I', len(mdat) + 8) + b'mdat' + mdat
+
+
+def _strftime(dt: pendulum.DateTime) -> str:
+    return dt.format('ddd MMM DD HH:mm:ss ZZ YYYY')
+
+
+class World:
+    """
+    Synthetic users and their weibos, generated from seed.
+
+    The stand-in account follows `users` users, each of them has
+    `friends` bilateral friends who are not followed. The same seed
+    always generates the same users and weibos, weibos are dated
+    backwards from the moment the world is created.
+    """
+    BASE_UID = 7000000000
+    PAGE_SIZE = 20
+
+    def __init__(self, users: int = 20, weibos: int = 100,
+                 friends: int = 5, edit_rate: float = 0.1,
+                 live_rate: float = 0.3, location_rate: float = 0.2,
+                 media_size: int = 256 * 1024, seed: int = 0) -> None:
+        """
+        Args:
+            users: number of users followed by the stand-in account
+            weibos: number of weibos posted by each user
+            friends: number of bilateral friends of each user
+            edit_rate: ratio of weibos have been edited
+            live_rate: ratio of photos are live photos
+            location_rate: ratio of weibos have location
+            media_size: bytes of each photo or live video
+        """
+        self.uids = [self.BASE_UID + i for i in range(users)]
+        self.others = [self.BASE_UID + i
+                       for i in range(users, users + users * friends)]
+        self._all = set(self.uids + self.others)
+        self.weibos_per_user = weibos
+        self.friends_per_user = friends
+        self.edit_rate = edit_rate
+        self.live_rate = live_rate
+        self.location_rate = location_rate
+        self.media_size = media_size
+        self.seed = seed
+        self.now = pendulum.now().start_of('minute')
+        self.locations = {
+            f'B2094{seed:02X}{i:04X}': loc for i, loc in enumerate(LOCATIONS)}
+        self._mblogs: dict[int, list[dict]] = {}
+        self._timeline: list[dict] | None = None
+
+    def _rng(self, *key) -> random.Random:
+        return random.Random('-'.join(map(str, (self.seed, *key))))
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self._all
+
+    def user(self, uid: int) -> dict:
+        rng = self._rng('user', uid)
+        return {
+            'id': uid,
+            'screen_name': f'standin_{uid - self.BASE_UID:05d}',
+            'gender': 'f',
+            'description': f'synthetic user {uid}',
+            'location': rng.choice(LOCATIONS)[0].split('·')[0],
+            'birthday': f'{rng.randint(1990, 2004)}-'
+                        f'{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'followers_count': rng.randint(100, 100000),
+            'follow_count': rng.randint(10, 1000),
+            'statuses_count': self.weibos_per_user,
+            'created_at': _strftime(self.now.subtract(years=8)),
+        }
+
+    def user_info(self, uid: int) -> dict:
+        """
+        the userInfo of m.weibo.cn/api/container/getIndex
+        """
+        user = self.user(uid)
+        return {
+            'id': uid,
+            'screen_name': user['screen_name'],
+            'gender': 'f',
+            'description': user['description'],
+            'statuses_count': user['statuses_count'],
+            'followers_count': user['followers_count'],
+            'followers_count_str': user['followers_count'],
+            'follow_count': user['follow_count'],
+            'following': True,
+            'follow_me': False,
+            'special_follow': False,
+            'close_blue_v': False,
+            'verified': False,
+            'verified_type': -1,
+            'mbrank': 0,
+            'mbtype': 0,
+            'urank': 1,
+            'svip': 0,
+            'like': False,
+            'like_me': False,
+            'avatar_hd': f'https://tvax1.sinaimg.cn/large/{uid}.jpg',
+        }
+
+    def friends(self, uid: int) -> list[int]:
+        return self._rng('friends', uid).sample(
+            self.others, min(self.friends_per_user, len(self.others)))
+
+    def mblogs(self, uid: int) -> list[dict]:
+        """
+        weibos of user in weico format, the latest first
+        """
+        if uid not in self._mblogs:
+            self._mblogs[uid] = self._gen_mblogs(uid)
+        return self._mblogs[uid]
+
+    def _gen_mblogs(self, uid: int) -> list[dict]:
+        rng = self._rng('weibos', uid)
+        index = uid - self.BASE_UID
+        created_at, mblogs = self.now, []
+        for n in range(self.weibos_per_user):
+            created_at = created_at.subtract(
+                minutes=rng.randint(60, 7 * 24 * 60))
+            # time ordered as real weibo id does
+            wid = int(created_at.timestamp()) * 100000 + index
+            mblogs.append(self._gen_mblog(rng, uid, wid, created_at, n))
+        return mblogs
+
+    def _gen_mblog(self, rng: random.Random, uid: int, wid: int,
+                   created_at: pendulum.DateTime, n: int) -> dict:
+        pics = [self._gen_pic(rng, wid, i)
+                for i in range(rng.choice([0, 1, 1, 3, 4, 6, 9]))]
+        edit_count = (rng.randint(1, 3) if 0 < len(pics) < 9 and
+                      rng.random() < self.edit_rate else 0)
+        mblog = {
+            'id': wid,
+            'idstr': str(wid),
+            'mid': str(wid),
+            'created_at': _strftime(created_at),
+            'text': f'synthetic weibo {n} of {uid}',
+            'source': '<a href="">iPhone客户端</a>',
+            'user': {k: v for k, v in self.user(uid).items()
+                     if k in ['id', 'screen_name', 'gender']},
+            'isLongText': False,
+            'mblog_vip_type': 0,
+            'region_name': f'发布于 {self.user(uid)["location"]}',
+            'reposts_count': rng.randint(0, 100),
+            'comments_count': rng.randint(0, 100),
+            'attitudes_count': rng.randint(0, 1000),
+            **self._pics_info(pics),
+        }
+        if edit_count:
+            # the last edit appends a photo
+            edited = self._gen_pic(rng, wid, len(pics))
+            mblog |= self._pics_info(pics + [edited])
+            mblog['edit_count'] = edit_count
+            mblog['edit_at'] = _strftime(created_at.add(minutes=30))
+            mblog['_hist'] = [pics] * edit_count + [pics + [edited]]
+        elif rng.random() < self.location_rate:
+            lid = rng.choice(list(self.locations))
+            mblog['url_struct'] = [{
+                'object_type': 'place',
+                'page_id': f'100101{lid}',
+                'url_title': self.locations[lid][0],
+            }]
+        return mblog
+
+    def _gen_pic(self, rng: random.Random, wid: int, i: int) -> dict:
+        pid = f'{wid:x}{i:02d}'
+        pic = {'pid': pid,
+               'url': f'https://wx{rng.randint(1, 4)}.sinaimg.cn/large/'
+                      f'{pid}.jpg'}
+        if rng.random() < self.live_rate:
+            pic['live'] = f'https://livephoto.us.sinaimg.cn/{pid}.mov'
+        return pic
+
+    @staticmethod
+    def _pics_info(pics: list[dict]) -> dict:
+        return {
+            'pic_num': len(pics),
+            'pic_ids': [p['pid'] for p in pics],
+            'pic_infos': {p['pid']: {'largest': {'url': p['url']},
+                                     'video': p.get('live', '')}
+                          for p in pics},
+        }
+
+    def weico(self, mblog: dict) -> dict:
+        return {k: v for k, v in mblog.items() if not k.startswith('_')}
+
+    def web(self, mblog: dict) -> dict:
+        mblog = self.weico(mblog)
+        infos = mblog.pop('pic_infos')
+        mblog['pics'] = [
+            {'pid': pid, 'url': info['largest']['url'],
+             'large': {'url': info['largest']['url']}}
+            | ({'videoSrc': info['video']} if info['video'] else {})
+            for pid, info in infos.items()]
+        mblog['id'] = str(mblog['id'])
+        return mblog
+
+    def mblog(self, wid: int) -> dict | None:
+        if (uid := self.BASE_UID + wid % 100000) not in self:
+            return
+        for mblog in self.mblogs(uid):
+            if mblog['id'] == wid:
+                return mblog
+
+    def hist_cards(self, wid: int) -> list[dict]:
+        """
+        history of the weibo, the latest first
+        """
+        if not (mblog := self.mblog(wid)):
+            return []
+        created_at = pendulum.from_format(
+            mblog['created_at'], 'ddd MMM DD HH:mm:ss ZZ YYYY')
+        hist = mblog.get('_hist') or [[]]
+        cards = []
+        for i, pics in enumerate(hist):
+            h = {'id': -1, 'created_at': mblog['created_at'],
+                 'text': mblog['text'], 'region_name': mblog['region_name'],
+                 **self._pics_info(pics)}
+            if i:
+                h['edit_at'] = _strftime(created_at.add(minutes=30))
+            cards.append({'card_type': 11,
+                          'card_group': [{'card_type': 9, 'mblog': h}]})
+        return cards[::-1]
+
+    def timeline(self) -> list[dict]:
+        if self._timeline is None:
+            mblogs = [m for uid in self.uids for m in self.mblogs(uid)]
+            self._timeline = sorted(
+                mblogs, key=lambda m: m['id'], reverse=True)
+        return self._timeline
+
+    def liked(self, uid: int) -> list[dict]:
+        """
+        weibos with photos of friends liked by user, the latest first
+        """
+        mblogs = [m for fid in self.friends(uid) for m in self.mblogs(fid)
+                  if m['pic_num']]
+        rng = self._rng('liked', uid)
+        mblogs = rng.sample(mblogs, len(mblogs) // 2)
+        return sorted(mblogs, key=lambda m: m['id'], reverse=True)
+
+    def paginate(self, items: list, page: int) -> list:
+        start = (page - 1) * self.PAGE_SIZE
+        return items[start:start + self.PAGE_SIZE]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Serve the weibo endpoints from server.world.
+
+    The original url is carried in path, i.e. /{host}/{path}?{query}.
+    """
+    server: 'StandinServer'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        if length := int(self.headers.get('Content-Length', 0)):
+            self.rfile.read(length)
+        self._handle()
+
+    def _handle(self):
+        parts = urlsplit(self.path)
+        host, _, path = parts.path.lstrip('/').partition('/')
+        path = '/' + path
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        url = f'https://{host}{path}'
+        self.server.count(url)
+        if host.endswith('sinaimg.cn'):
+            try:
+                return self._media(path)
+            except ConnectionError:
+                return
+        if error := self.server.inject_error(host, self.command):
+            return self._send(*error)
+        try:
+            self._send(*self._route(host, path, query))
+        except ConnectionError:
+            pass
+        except Exception as e:
+            console.log(f'stand-in failed on {self.path}: {e!r}',
+                        style='error')
+            self._send(500, b'', 'text/plain')
+
+    def _send(self, status: int, body: bytes, content_type: str,
+              headers: dict | None = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _media(self, path: str):
+        """
+        serve media with range support, cut off halfway at error_rate
+        """
+        size = self.server.world.media_size
+        if path.endswith('.mov'):
+            body, content_type = fake_mov(size), 'video/quicktime'
+        else:
+            body, content_type = fake_jpeg(size), 'image/jpeg'
+        etag = f'"{zlib.crc32(body):08x}"'
+        headers = {'Accept-Ranges': 'bytes', 'ETag': etag}
+        status, offset = 200, 0
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)',
+                             self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) == etag:
+            if (offset := int(match.group(1))) >= len(body):
+                return self._send(416, b'', 'text/plain',
+                                  {'Content-Range': f'bytes */{len(body)}'})
+            last = min(int(match.group(2) or len(body) - 1), len(body) - 1)
+            status = 206
+            headers['Content-Range'] = f'bytes {offset}-{last}/{len(body)}'
+            body = body[:last + 1]
+        body = body[offset:]
+        if not self.server.cut_media():
+            return self._send(status, body, content_type, headers)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 2])
+        self.close_connection = True
+
+    @staticmethod
+    def _json(js) -> tuple[int, bytes, str]:
+        return 200, json.dumps(js, ensure_ascii=False).encode(), \
+            'application/json; charset=utf-8'
+
+    @staticmethod
+    def _html(text: str) -> tuple[int, bytes, str]:
+        return 200, text.encode(), 'text/html; charset=utf-8'
+
+    def _route(self, host: str, path: str, query: dict):
+        world = self.server.world
+        match host, path:
+            case 'api.weibo.cn', '/2/profile/me':
+                return self._json({'mineinfo': {'screen_name': 'standin'}})
+            case 'api.weibo.cn', '/2/profile/statuses/tab':
+                return self._json(self._statuses_tab(query))
+            case 'api.weibo.cn', '/2/statuses/show':
+                if mblog := world.mblog(int(query['id'])):
+                    self.server.served.add(mblog['id'])
+                    return self._json(world.weico(mblog))
+                return self._json({'errmsg': '该微博不存在', 'errno': 20101})
+            case 'api.weibo.cn', ('/2/statuses/friends_timeline'
+                                  | '/2/groups/timeline'):
+                return self._json(self._timeline(query))
+            case 'api.weibo.cn', '/2/cardlist':
+                return self._json(self._cardlist(query))
+            case 'api.weibo.cn', '/2/friendships/bilateral':
+                return self._json(self._bilateral(query))
+            case 'api.weibo.cn', '/2/comments/build_comments':
+                return self._json({'status': self._geo(int(query['id']))})
+            case 'api.weibo.cn', _ if 'special_attention' in path:
+                return self._json({'result': True})
+            case 'api.weibo.cn', _ if '/friendships/' in path:
+                return self._json({'following': True})
+            case 'm.weibo.cn', '/api/container/getIndex':
+                return self._json(self._get_index(query))
+            case 'm.weibo.cn', '/api/attitudes/show':
+                return self._json({'ok': 1, 'msg': '数据获取成功',
+                                   'data': {'data': None}})
+            case 'm.weibo.cn', _ if path.startswith('/detail/'):
+                return self._detail(int(path.removeprefix('/detail/')))
+            case 'm.weibo.cn', _ if path.startswith('/n/'):
+                name = path.removeprefix('/n/')
+                for uid in world.uids + world.others:
+                    if world.user(uid)['screen_name'] == name:
+                        return 302, b'', 'text/html', {
+                            'Location': f'https://m.weibo.cn/u/{uid}'}
+                return self._html('')
+            case 'm.weibo.cn', _ if path.startswith('/u/'):
+                return self._html('')
+            case 'weibo.cn', _ if m := re.match(r'/(u/)?(\d+)(/info)?$', path):
+                return self._user_cn(int(m.group(2)))
+            case 'place.weibo.com', '/wandermap/pois':
+                return self._json(self._poi(query['poiid']))
+        return 404, b'', 'text/plain'
+
+    def _statuses_tab(self, query: dict) -> dict:
+        world = self.server.world
+        uid = int(re.match(r'230413(\d+)_', query['containerid']).group(1))
+        page = int(query.get('page', 1))
+        mblogs = world.paginate(
+            world.mblogs(uid) if uid in world else [], page)
+        if not mblogs:
+            return {'cards': [{'card_type': 58, 'name': '暂无微博'}]}
+        return {'cards': [{'card_type': 9, 'mblog': world.weico(m)}
+                          for m in mblogs]}
+
+    def _timeline(self, query: dict) -> dict:
+        world = self.server.world
+        mblogs = world.timeline()
+        if max_id := int(query.get('max_id', 0)):
+            mblogs = [m for m in mblogs if m['id'] <= max_id]
+        mblogs, rest = mblogs[:world.PAGE_SIZE], mblogs[world.PAGE_SIZE:]
+        return {'statuses': [world.weico(m) for m in mblogs],
+                'next_cursor': rest[0]['id'] if rest else 0}
+
+    def _cardlist(self, query: dict) -> dict:
+        world = self.server.world
+        containerid = query['containerid']
+        page = int(query.get('page', 1))
+        if m := re.match(r'230869(\d+)-_mix-_like-pic', containerid):
+            uid = int(m.group(1))
+            mblogs = world.paginate(
+                world.liked(uid) if uid in world else [], page)
+            if not mblogs:
+                return {'cards': None}
+            return {'cards': [{'card_type': 9, 'mblog': world.weico(m)}
+                              for m in mblogs]}
+        if m := re.match(r'231440_-_(\d+)', containerid):
+            return {'cards': world.paginate(
+                world.hist_cards(int(m.group(1))), page)}
+        if containerid.startswith('231093_-_'):
+            users = world.paginate(world.uids, page)
+            if not users:
+                return {'cards': [{'card_type': 58,
+                                   'name': '没有更多内容了'}]}
+            group = [{'card_type': 10, 'user': {
+                'id': uid, 'remark': '',
+                'screen_name': world.user(uid)['screen_name']}}
+                for uid in users]
+            return {'cards': [{'card_type': 11, 'card_group': group}]}
+        if containerid.startswith('231051_-_myfollow_followprofile_list'):
+            return {'cards': []}
+        if m := re.match(r'2306570042(\w+)', containerid):
+            name, lat, lng = world.locations[m.group(1)]
+            return {'cardlistInfo': {'title_top': name}, 'cards': [{
+                'card_group': [{
+                    'pic': '', 'title': f'位于：{name}',
+                    'scheme': f'latitude={lat}&longitude={lng}'}]}]}
+        return {'cards': None}
+
+    def _bilateral(self, query: dict) -> dict:
+        world = self.server.world
+        page = int(query.get('page', 1))
+        uid = int(query.get('uid', 0))
+        fids = world.paginate(world.friends(uid) if uid in world else [],
+                              page)
+        users = []
+        for fid in fids:
+            user = world.user(fid)
+            users.append(user | {
+                'remark': '',
+                'friends_count': user['follow_count'],
+                'bi_followers_count': world.friends_per_user,
+                'following': True,
+                'avatar_hd': f'https://tvax1.sinaimg.cn/crop.0.0.180.180.180/'
+                             f'{fid}.jpg?KID=imgbed',
+            })
+        return {'users': users,
+                'total_number': len(world.friends(uid)) if uid in world else 0}
+
+    def _geo(self, wid: int) -> dict:
+        world = self.server.world
+        if (mblog := world.mblog(wid)) and 'url_struct' in mblog:
+            lid = mblog['url_struct'][0]['page_id'].removeprefix('100101')
+            _, lat, lng = world.locations[lid]
+            return {'geo': {'type': 'Point', 'coordinates': [lat, lng]}}
+        return {'geo': None}
+
+    def _poi(self, lid: str) -> dict:
+        if not (loc := self.server.world.locations.get(lid)):
+            return {}
+        name, lat, lng = loc
+        return {'poiid': lid, 'name': name.split('·')[-1], 'lat': lat,
+                'lng': lng, 'address': name, 'country': '中国', 'pic': ''}
+
+    def _get_index(self, query: dict) -> dict:
+        world = self.server.world
+        containerid = query['containerid']
+        if m := re.match(r'100505(\d+)$', containerid):
+            if (uid := int(m.group(1))) not in world:
+                return {'ok': 0, 'msg': '这里还没有内容'}
+            return {'ok': 1, 'data': {'userInfo': world.user_info(uid)}}
+        if m := re.match(r'230283(\d+)_-_INFO', containerid):
+            user = world.user(int(m.group(1)))
+            items = {'所在地': user['location'],
+                     '生日': f"{user['birthday']} 摩羯座",
+                     'IP属地': user['location']}
+            return {'ok': 1, 'data': {'cards': [{'card_group': [
+                {'item_name': k, 'item_content': v}
+                for k, v in items.items()]}]}}
+        if m := re.match(r'230413(\d+)_', containerid):
+            uid = int(m.group(1))
+            mblogs = world.mblogs(uid) if uid in world else []
+            if since_id := int(query.get('since_id', 0)):
+                mblogs = [m for m in mblogs if m['id'] <= since_id]
+            mblogs, rest = mblogs[:world.PAGE_SIZE], mblogs[world.PAGE_SIZE:]
+            info = {'since_id': rest[0]['id']} if rest else {}
+            return {'ok': 1, 'data': {
+                'cardlistInfo': info,
+                'cards': [{'card_type': 9, 'mblog': world.web(m)}
+                          for m in mblogs]}}
+        return {'ok': 0, 'msg': '这里还没有内容'}
+
+    def _detail(self, wid: int):
+        if not (mblog := self.server.world.mblog(wid)):
+            return self._html(
+                '<html><head><title>微博-出错了</title></head>'
+                '<body><p>该微博不存在</p></body></html>')
+        data = json.dumps([{'status': self.server.world.web(mblog)}],
+                          ensure_ascii=False)
+        return self._html(
+            '<html><head><title>微博</title></head><body><script>'
+            f'var $render_data = {data}[0] || {{}};'
+            '</script></body></html>')
+
+    def _user_cn(self, uid: int):
+        world = self.server.world
+        if uid not in world:
+            return self._html('<html><body><div class="ps">'
+                              'User does not exists!</div></body></html>')
+        user = world.user(uid)
+        basic = '<br/>'.join([
+            f'昵称:{user["screen_name"]}', '性别:女',
+            f'地区:{user["location"]}', f'生日:{user["birthday"]}',
+            f'简介:{user["description"]}'])
+        return self._html(
+            '<html><body><div class="tip">基本信息</div>'
+            f'<div class="c">{basic}</div>'
+            '<div class="tip">其他信息</div><div class="c"></div>'
+            '</body></html>')
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    Local stand-in of the weibo endpoints, with injected errors.
+    """
+    daemon_threads = True
+
+    def __init__(self, world: World, port: int = 0,
+                 error_rate: float = 0) -> None:
+        """
+        Args:
+            port: port to listen, 0 to pick a free one
+            error_rate: ratio of api requests answered with an error,
+                and of media transfers cut off halfway
+        """
+        super().__init__(('127.0.0.1', port), StandinHandler)
+        self.world = world
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self.errors = 0
+        # weibos served by statuses/show
+        self.served: set[int] = set()
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._rng = random.Random(world.seed)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __str__(self) -> str:
+        minutes = (time.monotonic() - self.started_at) / 60
+        total = sum(self.requests.values())
+        weibos = len(self.served)
+        return (f'{total} requests ({total / minutes:.1f}/min, '
+                f'{self.errors} errors injected), {weibos} weibos '
+                f'({weibos / minutes:.1f}/min, '
+                f'{total / max(weibos, 1):.1f} requests/weibo), '
+                f'{dict(self.requests)}')
+
+    def count(self, url: str):
+        with self._lock:
+            self.requests[endpoint_family(url)] += 1
+
+    def inject_error(self, host: str, method: str) -> tuple | None:
+        if method != 'GET' or host.endswith('sinaimg.cn'):
+            return
+        with self._lock:
+            if self._rng.random() >= self.error_rate:
+                return
+            self.errors += 1
+            kind = self._rng.choice(['errmsg', 'throttle', 'page'])
+        if kind == 'throttle':
+            return 418, b'', 'text/plain'
+        if host == 'api.weibo.cn' or kind == 'errmsg':
+            return StandinHandler._json({'errmsg': '请求超时', 'errno': 10001})
+        return StandinHandler._html(
+            '<html><head><title>微博-出错了</title></head>'
+            '<body><p>请求超时</p></body></html>')
+
+    def cut_media(self) -> bool:
+        with self._lock:
+            if cut := self._rng.random() < self.error_rate:
+                self.errors += 1
+        return cut
+
+    def start(self) -> threading.Thread:
+        """
+        serve in a daemon thread
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class StandinTransport(httpx.AsyncBaseTransport):
+    """
+    Send every request to the stand-in server instead of its host.
+    """
+
+    def __init__(self, url: str, transport: httpx.AsyncBaseTransport):
+        self.url = httpx.URL(url)
+        self.transport = transport
+
+    async def handle_async_request(
+            self, request: httpx.Request) -> httpx.Response:
+        url = request.url
+        path = f'/{url.host}{url.raw_path.decode()}'
+        request = httpx.Request(
+            request.method, self.url.join(path),
+            headers=[(k, v) for k, v in request.headers.raw
+                     if k.lower() != b'host'],
+            content=await request.aread(),
+            extensions=request.extensions)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,47 @@
+from sinaspider.cache import DeadUrls, ResponseCache, normalize_url
+
+
+def test_normalize_url():
+    assert normalize_url('https://m.weibo.cn/api?b=2&a=1#top') == (
+        'https://m.weibo.cn/api?a=1&b=2')
+    assert normalize_url('https://m.weibo.cn/api?b=2',
+                         {'a': 1, 'c': None}) == (
+        'https://m.weibo.cn/api?a=1&b=2')
+
+
+def test_ttl_matching(tmp_path):
+    cache = ResponseCache(tmp_path / 'responses.sqlite')
+    assert cache.ttl(normalize_url(
+        'https://m.weibo.cn/api/container/getIndex',
+        {'containerid': '1005051234'})) == 6 * 3600
+    assert cache.ttl(
+        'https://m.weibo.cn/api/container/getIndex?containerid=107603') \
+        is None
+
+
+def test_cache_by_account(tmp_path):
+    cache = ResponseCache(tmp_path / 'responses.sqlite')
+    url = 'https://m.weibo.cn/api/container/getIndex?containerid=1005051'
+    cache.set(url, 'art', b'{"ok": 1}')
+    assert cache.get(url, 'art') == b'{"ok": 1}'
+    assert cache.get(url, 'main') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.invalidate('containerid=1005051') == 1
+    assert cache.get(url, 'art') is None
+    uncached = 'https://m.weibo.cn/detail/1'
+    cache.set(uncached, 'art', b'{}')
+    assert cache.get(uncached, 'art') is None
+
+
+def test_expired_response(tmp_path):
+    cache = ResponseCache(tmp_path / 'responses.sqlite',
+                          ttls=[('detail', -1)])
+    cache.set('https://m.weibo.cn/detail/1', 'art', b'{}')
+    assert cache.get('https://m.weibo.cn/detail/1', 'art') is None
+
+
+def test_dead_urls(tmp_path):
+    dead_urls = DeadUrls(tmp_path / 'dead_urls.sqlite')
+    dead_urls.add('https://wx1.sinaimg.cn/large/a.jpg', '404')
+    assert 'https://wx1.sinaimg.cn/large/a.jpg' in dead_urls
+    assert 'https://wx1.sinaimg.cn/large/b.jpg' not in dead_urls
@@ -0,0 +1,57 @@
+import asyncio
+import gzip
+import itertools
+import json
+
+import httpx
+import pytest
+
+from sinaspider.cassette import Cassette, CassetteTransport
+from sinaspider.exceptions import CassetteMiss
+
+
+async def fetch(transport: httpx.AsyncBaseTransport,
+                urls: list[str]) -> list[dict]:
+    async with httpx.AsyncClient(transport=transport) as client:
+        return [(await client.get(url)).json() for url in urls]
+
+
+def test_record_and_replay(tmp_path):
+    path = tmp_path / 'cassette.sqlite'
+    count = itertools.count()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.dumps({'n': next(count)}).encode()
+        return httpx.Response(200, content=gzip.compress(body), headers={
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip'})
+
+    def offline(request: httpx.Request) -> httpx.Response:
+        raise AssertionError(f'{request.url} sent in replay')
+    urls = ['https://m.weibo.cn/api?b=2&a=1',
+            'https://m.weibo.cn/api?a=1&b=2',
+            'https://m.weibo.cn/detail/1']
+    recorder = Cassette(path, 'record')
+    recorded = asyncio.run(fetch(
+        CassetteTransport(recorder, httpx.MockTransport(handler)), urls))
+    assert recorded == [{'n': 0}, {'n': 1}, {'n': 2}]
+    assert recorder.recorded == 3
+
+    player = Cassette(path, 'replay', latency=0)
+    replayed = asyncio.run(fetch(
+        CassetteTransport(player, httpx.MockTransport(offline)),
+        urls + urls[:1]))
+    # identical requests in the recorded order, the last one repeats
+    assert replayed == recorded + recorded[1:2]
+    assert player.replayed == 4
+    with pytest.raises(CassetteMiss):
+        asyncio.run(fetch(
+            CassetteTransport(player, httpx.MockTransport(offline)),
+            ['https://m.weibo.cn/detail/2']))
+
+
+def test_replay_needs_cassette(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        Cassette(tmp_path / 'missing.sqlite', 'replay')
+    with pytest.raises(ValueError):
+        Cassette(tmp_path / 'cassette.sqlite', 'rewind')
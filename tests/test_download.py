@@ -0,0 +1,121 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from sinaspider import helper
+from sinaspider import journal as journal_module
+from sinaspider.exceptions import (
+    DownloadFilesFailed,
+    MediaExpired,
+    RetryLater
+)
+from sinaspider.journal import DownloadJournal
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    journal = DownloadJournal(tmp_path / 'downloads.sqlite')
+    monkeypatch.setattr(helper.client, 'journal', journal)
+    return journal
+
+
+def rows(journal: DownloadJournal) -> list[tuple]:
+    return journal._conn.execute(
+        'SELECT key, state, attempts, error FROM job ORDER BY id').fetchall()
+
+
+async def aiter(imgs):
+    for img in imgs:
+        yield img
+
+
+def test_failed_item_stays_failed(tmp_path, journal, monkeypatch):
+    async def download_file_pair(img):
+        raise ValueError('boom')
+    monkeypatch.setattr(helper, 'download_file_pair', download_file_pair)
+    img = [{'url': 'https://wx1.sinaimg.cn/large/a.jpg',
+            'filepath': tmp_path, 'filename': 'a.jpg'}]
+    with pytest.raises(DownloadFilesFailed):
+        asyncio.run(helper.download_files(aiter([img]), workers=2))
+    [(_, state, attempts, error)] = rows(journal)
+    assert (state, attempts) == ('failed', 1)
+    assert 'boom' in error
+
+
+def expiring(tmp_path, name: str, expires: float) -> list[dict]:
+    return [{'url': f'https://wx1.sinaimg.cn/large/{name}?Expires='
+             f'{int(expires)}', 'filepath': tmp_path, 'filename': name}]
+
+
+def test_expired_item_resolved_or_skipped(tmp_path, journal, monkeypatch):
+    downloaded = []
+
+    async def download_file_pair(img):
+        if (expires := helper._expires(img[0]['url'])) < time.time():
+            raise MediaExpired(img[0]['url'], expires)
+        downloaded.append(img[0]['filename'])
+
+    async def resolve(img):
+        if img[0]['filename'] == 'gone.jpg':
+            return
+        return expiring(tmp_path, img[0]['filename'], time.time() + 60)
+    monkeypatch.setattr(helper, 'download_file_pair', download_file_pair)
+    imgs = [expiring(tmp_path, name, time.time() - 60)
+            for name in ['old.jpg', 'gone.jpg']]
+    asyncio.run(helper.download_files(aiter(imgs), resolve=resolve))
+    assert downloaded == ['old.jpg']
+    assert [state for _, state, *_ in rows(journal)] == ['done', 'done']
+
+
+def test_sooner_expiry_downloaded_first(tmp_path, journal, monkeypatch):
+    downloaded = []
+
+    async def download_file_pair(img):
+        await asyncio.sleep(0.01)
+        downloaded.append(img[0]['filename'])
+    monkeypatch.setattr(helper, 'download_file_pair', download_file_pair)
+    imgs = [[{'url': 'https://wx1.sinaimg.cn/large/a.jpg',
+              'filepath': tmp_path, 'filename': 'never.jpg'}],
+            expiring(tmp_path, 'late.jpg', time.time() + 600),
+            expiring(tmp_path, 'soon.jpg', time.time() + 60)]
+    asyncio.run(helper.download_files(aiter(imgs), workers=3))
+    assert downloaded == ['soon.jpg', 'late.jpg', 'never.jpg']
+
+
+def test_retry_later_counts_one_attempt(tmp_path, journal, monkeypatch):
+    url = 'https://wx1.sinaimg.cn/large/a.jpg'
+    pickups, kept = [], []
+
+    async def download_file_pair(img):
+        pickups.append(img[0].get('attempt', 0))
+        kept.append(json.loads(journal._conn.execute(
+            'SELECT medias FROM job').fetchone()[0])[0].get('attempt', 0))
+        if len(pickups) < 3:
+            raise RetryLater(url, len(pickups), 0.01)
+    monkeypatch.setattr(helper, 'download_file_pair', download_file_pair)
+    img = [{'url': url, 'filepath': tmp_path, 'filename': 'a.jpg'}]
+    asyncio.run(helper.download_files(aiter([img])))
+    assert pickups == kept == [0, 1, 2]
+    [(_, state, attempts, _)] = rows(journal)
+    assert (state, attempts) == ('done', 1)
+
+
+def test_resumed_item_downloaded_once(tmp_path, journal, monkeypatch):
+    calls = []
+
+    async def download_file_pair(img):
+        calls.append(img[0]['filename'])
+        await asyncio.sleep(0.01)
+    monkeypatch.setattr(helper, 'download_file_pair', download_file_pair)
+    img = [{'url': 'https://wx1.sinaimg.cn/large/a.jpg',
+            'filepath': tmp_path, 'filename': 'a.jpg'}]
+    journal.add(img)
+    # left by a dead process
+    journal._conn.execute('UPDATE job SET pid = -1')
+    monkeypatch.setattr(journal_module, '_is_alive', lambda pid: False)
+    asyncio.run(helper.download_files(aiter([img, img]), workers=2))
+    assert calls == ['a.jpg']
+    [(_, state, attempts, _)] = rows(journal)
+    assert (state, attempts) == ('done', 1)
@@ -0,0 +1,114 @@
+import asyncio
+import re
+
+import httpx
+import pytest
+
+from sinaspider import helper
+from sinaspider.standin import fake_jpeg
+
+URL = 'https://wx1.sinaimg.cn/large/a.jpg'
+
+
+class Chunks(httpx.AsyncByteStream):
+    """
+    body in small chunks, broken off after `until` bytes if given
+    """
+
+    def __init__(self, body: bytes, until: int | None = None) -> None:
+        self.body = body
+        self.until = until
+
+    async def __aiter__(self):
+        body = self.body[:self.until]
+        for i in range(0, len(body), 4096):
+            yield body[i:i + 4096]
+        if self.until is not None:
+            raise httpx.ReadError('broken off')
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """
+    serve the downloads of helper.client by handler
+    """
+    def serve(handler):
+        monkeypatch.setattr(helper.client, '_client', httpx.AsyncClient(
+            transport=httpx.MockTransport(handler), follow_redirects=True))
+    return serve
+
+
+def test_streamed_to_part(tmp_path, serve):
+    body = fake_jpeg(200_000)
+    serve(lambda request: httpx.Response(
+        200, headers={'Content-Length': str(len(body))},
+        stream=Chunks(body)))
+    img = asyncio.run(helper.download_single_file(URL, tmp_path, 'a.jpg'))
+    assert img.read_bytes() == body
+    assert list(tmp_path.iterdir()) == [img]
+
+
+def test_part_over_length_removed(tmp_path):
+    part = tmp_path / 'a.jpg.part'
+
+    async def chunks():
+        yield bytes(10)
+    assert asyncio.run(
+        helper._write_part(part, bytes(10), chunks(), 15)) == 20
+    assert not part.exists()
+
+
+def test_resumed_after_redirect(tmp_path, serve):
+    body = fake_jpeg(200_000)
+    ranges = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == 'wx1.sinaimg.cn':
+            return httpx.Response(302, headers={
+                'Location': str(request.url.copy_with(host='wx2.sinaimg.cn'))})
+        ranges.append(request.headers.get('Range'))
+        headers = {'Accept-Ranges': 'bytes', 'ETag': '"v1"'}
+        if not ranges[-1]:
+            return httpx.Response(
+                200, headers=headers | {'Content-Length': str(len(body))},
+                stream=Chunks(body, until=100_000))
+        assert request.headers['If-Range'] == '"v1"'
+        first = int(re.match(r'bytes=(\d+)-$', ranges[-1]).group(1))
+        return httpx.Response(206, headers=headers | {
+            'Content-Length': str(len(body) - first),
+            'Content-Range': f'bytes {first}-{len(body) - 1}/{len(body)}'},
+            stream=Chunks(body[first:]))
+    serve(handler)
+    img = asyncio.run(helper.download_single_file(URL, tmp_path, 'a.jpg'))
+    assert img.read_bytes() == body
+    # what was written before breaking off is not fetched again
+    assert ranges == [None, f'bytes={helper.CHUNK_SIZE}-']
+
+
+def test_downloaded_in_ranges(tmp_path, serve, monkeypatch):
+    monkeypatch.setattr(helper, 'RANGED_THRESHOLD', 100_000)
+    monkeypatch.setattr(helper, 'RANGE_SIZE', 32 << 10)
+    body = fake_jpeg(200_000)
+    ranges = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        headers = {'Accept-Ranges': 'bytes', 'ETag': '"v1"'}
+        if not (range_ := request.headers.get('Range')):
+            return httpx.Response(
+                200, headers=headers | {'Content-Length': str(len(body))},
+                stream=Chunks(body))
+        assert request.headers['If-Range'] == '"v1"'
+        first, last = map(int, re.match(
+            r'bytes=(\d+)-(\d+)$', range_).groups())
+        ranges.append((first, last))
+        return httpx.Response(206, headers=headers | {
+            'Content-Length': str(last - first + 1),
+            'Content-Range': f'bytes {first}-{last}/{len(body)}'},
+            stream=Chunks(body[first:last + 1]))
+    serve(handler)
+    img = asyncio.run(helper.download_single_file(URL, tmp_path, 'a.jpg'))
+    assert img.read_bytes() == body
+    assert sorted(ranges) == [
+        (first, min(first + (32 << 10), len(body)) - 1)
+        for first in range(0, len(body), 32 << 10)]
+    assert list(tmp_path.iterdir()) == [img]
@@ -0,0 +1,107 @@
+import asyncio
+
+import httpx
+import pytest
+
+from sinaspider.exceptions import RequestFailed
+from sinaspider.helper import Fetcher, HttpClient
+from sinaspider.limiter import Scheduler
+from sinaspider.standin import StandinServer, World
+
+
+@pytest.fixture(scope='module')
+def standin():
+    server = StandinServer(World(users=2, weibos=5, friends=1))
+    server.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def fetcher(standin):
+    fetcher = Fetcher(art_login=True)
+    asyncio.run(fetcher.configure(standin=standin.url))
+    fetcher.backoff.base = 0.001
+    for account in fetcher.accounts.values():
+        account.scheduler = Scheduler(rate=1e6, burst=1e6, adaptive=False)
+    return fetcher
+
+
+def test_configure_closes_old_clients():
+    fetcher, client = Fetcher(), HttpClient()
+    sessions = [account.sess for account in fetcher.accounts.values()]
+    old_client = client._client
+
+    async def main():
+        await fetcher.configure(timeout=httpx.Timeout(5))
+        await client.configure(timeout=httpx.Timeout(5))
+    asyncio.run(main())
+    assert all(sess.is_closed for sess in sessions)
+    assert old_client.is_closed and not client._client.is_closed
+
+
+def test_not_found_raised_at_once(fetcher):
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(fetcher.get('https://m.weibo.cn/nonexistent'))
+    assert fetcher.breaker('https://m.weibo.cn/').failures == 0
+
+
+def test_failed_check_capped(fetcher):
+    url = 'https://m.weibo.cn/api/container/getIndex?containerid=1005051'
+    with pytest.raises(RequestFailed):
+        asyncio.run(fetcher.get(url, check=lambda r: 'incomplete'))
+    assert fetcher.breaker(url).failures == 0
+
+
+def test_pool_spreads_backlog(fetcher, monkeypatch):
+    for account in fetcher.accounts.values():
+        account.scheduler = Scheduler(rate=20, burst=1, adaptive=False)
+    served = []
+    pause = fetcher._pause
+
+    async def _pause(account, url, lane):
+        served.append(account.name)
+        await pause(account, url, lane)
+    monkeypatch.setattr(fetcher, '_pause', _pause)
+    url = 'https://m.weibo.cn/api/container/getIndex?containerid=100505'
+
+    async def main():
+        await asyncio.gather(*(fetcher.get(f'{url}{i}', pool=True)
+                               for i in range(10)))
+    asyncio.run(main())
+    assert served.count('main') == served.count('art') == 5
+
+
+def test_pool_throttled_capped(fetcher):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(418)
+    for account in fetcher.accounts.values():
+        account.sess = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler))
+    with pytest.raises(RequestFailed):
+        asyncio.run(fetcher.get('https://m.weibo.cn/detail/1', pool=True))
+    assert len(requests) == Fetcher.MAX_ATTEMPTS
+
+
+def test_identical_requests_coalesced(fetcher):
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={'ok': 1})
+    for account in fetcher.accounts.values():
+        account.sess = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler))
+    url = 'https://m.weibo.cn/api/container/getIndex?containerid=1005051'
+
+    async def main():
+        return await asyncio.gather(
+            *(fetcher.get(url) for _ in range(4)),
+            fetcher.get(url, params={'page': 2}))
+    responses = asyncio.run(main())
+    assert len(requests) == 2 and fetcher.collapsed == 3
+    assert len({id(r) for r in responses}) == 2
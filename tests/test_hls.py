@@ -0,0 +1,50 @@
+import pytest
+
+from sinaspider.hls import Playlist
+
+MASTER = '''#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360
+low/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2400000,RESOLUTION=1280x720
+high/index.m3u8
+'''
+
+MEDIA = '''#EXTM3U
+#EXT-X-TARGETDURATION:6
+#EXT-X-MAP:URI="init.mp4"
+#EXTINF:6.0,
+seg0.m4s
+#EXTINF:6.0,
+https://cdn.example.com/seg1.m4s
+#EXT-X-ENDLIST
+'''
+
+
+def test_master_playlist():
+    playlist = Playlist(MASTER, 'https://f.video.weibocdn.com/v/master.m3u8')
+    assert playlist.is_master
+    assert playlist.best_variant() == (
+        'https://f.video.weibocdn.com/v/high/index.m3u8')
+
+
+def test_media_playlist():
+    playlist = Playlist(MEDIA, 'https://f.video.weibocdn.com/v/index.m3u8')
+    assert not playlist.is_master
+    assert not playlist.encrypted
+    assert playlist.init == 'https://f.video.weibocdn.com/v/init.mp4'
+    assert playlist.segments == [
+        'https://f.video.weibocdn.com/v/seg0.m4s',
+        'https://cdn.example.com/seg1.m4s']
+
+
+def test_encrypted_playlist():
+    text = MEDIA.replace(
+        '#EXTINF', '#EXT-X-KEY:METHOD=AES-128,URI="key"\n#EXTINF', 1)
+    assert Playlist(text, 'https://x/index.m3u8').encrypted
+    text = MEDIA.replace('#EXTINF', '#EXT-X-KEY:METHOD=NONE\n#EXTINF', 1)
+    assert not Playlist(text, 'https://x/index.m3u8').encrypted
+
+
+def test_not_playlist():
+    with pytest.raises(ValueError):
+        Playlist('<html></html>', 'https://x/index.m3u8')
@@ -0,0 +1,62 @@
+from pathlib import Path
+
+from sinaspider import journal as journal_module
+from sinaspider.journal import DownloadJournal
+
+
+def medias(tmp_path: Path, name: str = 'a.jpg') -> list[dict]:
+    return [{'url': f'https://wx1.sinaimg.cn/large/{name}',
+             'filepath': tmp_path, 'filename': name}]
+
+
+def state(journal: DownloadJournal, job: int) -> tuple:
+    return journal._conn.execute(
+        'SELECT state, attempts, error FROM job WHERE id = ?',
+        (job,)).fetchone()
+
+
+def test_transitions(tmp_path):
+    journal = DownloadJournal(tmp_path / 'downloads.sqlite')
+    job = journal.add(medias(tmp_path))
+    assert state(journal, job) == ('queued', 0, None)
+    journal.start(job)
+    assert state(journal, job) == ('running', 1, None)
+    journal.fail(job, ValueError('boom'))
+    assert state(journal, job) == ('failed', 1, "ValueError('boom')")
+    journal.start(job)
+    journal.done(job)
+    assert state(journal, job) == ('done', 2, None)
+
+
+def test_add_again_requeues(tmp_path):
+    journal = DownloadJournal(tmp_path / 'downloads.sqlite')
+    job = journal.add(medias(tmp_path))
+    journal.start(job)
+    journal.fail(job, ValueError('boom'))
+    assert journal.add(medias(tmp_path)) == job
+    assert state(journal, job) == ('queued', 0, None)
+
+
+def test_leftovers_of_dead_process(tmp_path, monkeypatch):
+    journal = DownloadJournal(tmp_path / 'downloads.sqlite')
+    jobs = [journal.add(medias(tmp_path, f'{i}.jpg')) for i in range(3)]
+    journal.start(jobs[0])
+    journal.done(jobs[1])
+    for _ in range(DownloadJournal.MAX_ATTEMPTS):
+        journal.start(jobs[2])
+        journal.fail(jobs[2], ValueError('boom'))
+    retried = medias(tmp_path, '0.jpg')
+    retried[0]['attempt'] = 3
+    journal.retry(jobs[0], retried)
+    # alive, nothing to claim
+    assert journal.leftovers() == []
+
+    journal._conn.execute('UPDATE job SET pid = -1')
+    monkeypatch.setattr(journal_module, '_is_alive', lambda pid: False)
+    [(job, left)] = journal.leftovers()
+    assert job == jobs[0]
+    assert left == [{'url': 'https://wx1.sinaimg.cn/large/0.jpg',
+                     'filepath': tmp_path, 'filename': '0.jpg',
+                     'attempt': 3}]
+    # claimed by this process now
+    assert journal.leftovers() == []
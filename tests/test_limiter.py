@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+import pytest
+
+from sinaspider.limiter import (
+    BandwidthLimiter,
+    FairQueue,
+    HostLimiter,
+    Scheduler,
+    endpoint_family
+)
+
+
+def test_endpoint_family():
+    assert endpoint_family('https://api.weibo.cn/2/cardlist') == 'api'
+    assert endpoint_family('https://m.weibo.cn/detail/1') == 'm'
+    assert endpoint_family('https://wx3.sinaimg.cn/large/a.jpg') == 'media'
+    assert endpoint_family('https://example.com/') == 'other'
+
+
+def test_fair_queue_by_weight():
+    async def main():
+        queue = FairQueue({'fast': 3, 'slow': 1})
+        futures = {queue.put(lane): lane
+                   for lane in ['slow'] * 4 + ['fast'] * 6}
+        return [futures[queue.pop()] for _ in range(8)]
+    served = asyncio.run(main())
+    assert served[0] == 'fast'
+    assert served.count('fast') == 6 and served.count('slow') == 2
+
+
+def test_scheduler_paces_family():
+    scheduler = Scheduler(rate=20, burst=1, adaptive=False)
+    url = 'https://m.weibo.cn/api/container/getIndex'
+
+    async def main():
+        start = time.monotonic()
+        await asyncio.gather(*(scheduler.acquire(url) for _ in range(5)))
+        return time.monotonic() - start
+    assert 0.15 < asyncio.run(main()) < 1
+
+
+def test_scheduler_aimd():
+    scheduler = Scheduler(rate=0.5)
+    url = 'https://api.weibo.cn/2/cardlist'
+    scheduler.success(url)
+    assert scheduler.state()['api'] == 0.5 + Scheduler.INCREASE
+    scheduler.throttled(url)
+    assert scheduler.state()['api'] == (0.5 + Scheduler.INCREASE) / 2
+
+
+def test_host_limiter_waits_for_slot():
+    limiter = HostLimiter()
+    limiter.LIMITS = {'wx1.sinaimg.cn': 2}
+    url = 'https://wx1.sinaimg.cn/large/a.jpg'
+
+    async def main():
+        await limiter.acquire(url)
+        await limiter.acquire(url)
+        waiter = asyncio.create_task(limiter.acquire(url))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        limiter.release(url, size=100)
+        await asyncio.wait_for(waiter, 1)
+    asyncio.run(main())
+
+
+def test_host_limiter_aimd():
+    limiter = HostLimiter()
+    url = 'https://wx1.sinaimg.cn/large/a.jpg'
+    host = limiter.host(url)
+
+    async def main():
+        for _ in range(HostLimiter.LIMIT):
+            await limiter.acquire(url)
+            limiter.release(url, size=100)
+        assert host.limit == HostLimiter.LIMIT + 1
+        for _ in range(2):
+            await limiter.acquire(url)
+            limiter.release(url, failed=True)
+        # cut once per window
+        assert host.limit == (HostLimiter.LIMIT + 1) * HostLimiter.DECREASE
+    asyncio.run(main())
+
+
+def test_bandwidth_parse():
+    limiter = BandwidthLimiter.parse(['2M', '0@00:00-07:00',
+                                      '512K@22:30-23:00'])
+    assert limiter.rate == 2 << 20
+    assert limiter.windows == [(0, 420, None), (1350, 1380, 512 << 10)]
+    with pytest.raises(ValueError):
+        BandwidthLimiter.parse(['fast'])
+    with pytest.raises(ValueError):
+        BandwidthLimiter.parse(['1M@7-8'])
+    with pytest.raises(ValueError):
+        # no headroom left for api requests
+        BandwidthLimiter.parse(['64K'])
+
+
+def test_bandwidth_window(monkeypatch):
+    limiter = BandwidthLimiter(1 << 20, [(22 * 60, 7 * 60, None)])
+    for hour, rate in [(23, None), (3, None),
+                       (12, (1 << 20) - BandwidthLimiter.HEADROOM)]:
+        monkeypatch.setattr(time, 'localtime', lambda: time.struct_time(
+            (2024, 1, 1, hour, 0, 0, 0, 1, 0)))
+        assert limiter.current_rate() == rate
@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+from exiftool.exceptions import ExifToolExecuteError
+
+from sinaspider import metadata
+from sinaspider.metadata import MetadataWriter
+from sinaspider.postprocess import PostProcessor
+
+
+class FakeExifTool:
+    def __init__(self) -> None:
+        self.calls = []
+        self.params = []
+
+    def execute(self, *params):
+        self.params.append(params)
+        if not params[0].startswith('-j='):
+            return
+        with open(params[0].removeprefix('-j=')) as f:
+            tags = json.load(f)
+        self.calls.append(tags)
+        if any('bad' in t['SourceFile'] for t in tags):
+            raise ExifToolExecuteError(1, '', 'error', list(params))
+
+
+def test_tags_written_as_set_tags_gives(tmp_path, monkeypatch):
+    et = FakeExifTool()
+    monkeypatch.setattr(metadata, 'ExifToolHelper', lambda: et)
+    writer = MetadataWriter(PostProcessor())
+    tags = {'XMP:BlogTitle': 'a\nb', 'XMP:MakerNote': {'id': 1},
+            'XMP:SeriesNumber': 2, 'XMP:Keywords': ['x', 3]}
+    asyncio.run(writer.write(tmp_path / 'a.jpg', tags))
+    [[written]] = et.calls
+    assert written == {'SourceFile': str(tmp_path / 'a.jpg'),
+                       'XMP:BlogTitle': 'a\nb',
+                       'XMP:MakerNote': "{'id': 1}",
+                       'XMP:SeriesNumber': '2',
+                       'XMP:Keywords': ['x', '3']}
+
+
+def test_failed_file_of_batch(tmp_path, monkeypatch):
+    et = FakeExifTool()
+    monkeypatch.setattr(metadata, 'ExifToolHelper', lambda: et)
+    writer = MetadataWriter(PostProcessor())
+
+    async def main():
+        return await asyncio.gather(*(
+            writer.write(tmp_path / f'{name}.jpg', {'XMP:Title': name})
+            for name in ['a', 'bad', 'c']), return_exceptions=True)
+    a, bad, c = asyncio.run(main())
+    assert a is None and c is None
+    assert isinstance(bad, ExifToolExecuteError)
+    assert [len(call) for call in et.calls] == [3, 1, 1, 1]
+
+
+def test_sidecars_written_then_embedded(tmp_path, monkeypatch):
+    et = FakeExifTool()
+    monkeypatch.setattr(metadata, 'ExifToolHelper', lambda: et)
+    writer = MetadataWriter(PostProcessor(), sidecar=True)
+    new, old = tmp_path / 'new.jpg', tmp_path / 'old.jpg'
+    old.with_suffix('.xmp').touch()
+
+    async def main():
+        await asyncio.gather(writer.write(new, {'XMP:Title': 'new'}),
+                             writer.write(old, {'XMP:Title': 'old'}))
+    asyncio.run(main())
+    # existing sidecars are updated, new ones created next to the media
+    written = {tags[0]['SourceFile']: params[1:-1]
+               for tags, params in zip(et.calls, et.params)}
+    assert written == {str(old.with_suffix('.xmp')): tuple(writer.PARAMS),
+                       str(new): tuple(writer.SIDECAR_PARAMS)}
+
+    new.with_suffix('.xmp').touch()
+    assert asyncio.run(writer.embed([new, old])) == [None, None]
+    assert et.params[-1] == (*writer.EMBED_PARAMS, new, old)
+    assert list(tmp_path.iterdir()) == []